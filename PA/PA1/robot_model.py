@@ -1,5 +1,7 @@
 import os
-from typing import List
+import hashlib
+import pickle
+from typing import Dict, List, Tuple
 import numpy as np
 import xml.etree.ElementTree as ET
 
@@ -9,11 +11,95 @@ from rotation import rpy_to_mat
 from utils import str_to_np
 from vis import Vis
 
+# bump this when the cached RobotModel state changes
+URDF_CACHE_VERSION = 2
+
+
+def sort_kinematic_tree(
+    links: List[Link], joints: List[Joint], joint_links: Dict[str, Tuple[str, str]]
+) -> Tuple[List[str], List[str]]:
+    """
+    Sort the links and joints of a kinematic tree in topological order.
+
+    Parameters
+    ----------
+    links: List[Link]
+        The links of the robot
+    joints: List[Joint]
+        The joints connecting the links
+    joint_links: Dict[str, Tuple[str, str]]
+        The names of the parent and child link of each joint
+
+    Returns
+    -------
+    Tuple[List[str], List[str]]
+        The names of the links (root first) and of the joints, where every
+        parent comes before its children
+    """
+    link_names = {l.name for l in links}
+    children = {l.name: [] for l in links}
+    child_links = set()
+    for joint in joints:
+        parent, child = joint_links[joint.name]
+        if parent not in link_names or child not in link_names:
+            raise ValueError(f"Joint {joint.name} connects unknown links")
+        if child in child_links:
+            raise ValueError(f"Link {child} has more than one parent joint")
+        children[parent].append(joint.name)
+        child_links.add(child)
+    roots = [l.name for l in links if l.name not in child_links]
+    if len(roots) != 1:
+        raise ValueError(f"Expected a single root link, got {roots}")
+
+    # 广度优先遍历,同一深度的兄弟分支相邻
+    sorted_links, sorted_joints = roots, []
+    for link in sorted_links:
+        for joint in children[link]:
+            sorted_joints.append(joint)
+            sorted_links.append(joint_links[joint][1])
+    if len(sorted_links) != len(links):
+        raise ValueError("The kinematic tree contains a cycle")
+    return sorted_links, sorted_joints
+
+
+def urdf_cache_key(robot_cfg: RobotConfig) -> str:
+    """
+    The key of the compiled model cache for the given RobotConfig.
+
+    It depends on the URDF content, the directory used to resolve mesh
+    paths and the requested link and joint order.
+    """
+    with open(robot_cfg.urdf_path, "rb") as f:
+        content = f.read()
+    h = hashlib.sha256(content)
+    h.update(
+        repr(
+            (
+                URDF_CACHE_VERSION,
+                os.path.abspath(os.path.dirname(robot_cfg.urdf_path)),
+                robot_cfg.link_names,
+                robot_cfg.joint_names,
+            )
+        ).encode()
+    )
+    return h.hexdigest()
+
 
 class RobotModel:
     robot_cfg: RobotConfig
     links: List[Link]
     joints: List[Joint]
+    joint_links: Dict[str, Tuple[str, str]]
+    revolute_joint_indices: np.ndarray
+    revolute_axes: np.ndarray
+    revolute_skew: np.ndarray
+    revolute_skew_sq: np.ndarray
+    revolute_parents: np.ndarray
+    revolute_levels: List[np.ndarray]
+    chain_offsets: np.ndarray
+    frame_ancestors: np.ndarray
+    link_anchors: np.ndarray
+    link_offsets: np.ndarray
 
     def __init__(self, robot_cfg: RobotConfig):
         """
@@ -31,13 +117,12 @@ class RobotModel:
         """
         Compute forward kinematics for all of the links.
 
-        Here we assume the i-th joint has i-th link as parent
-        and i+1-th link as child.
-
-        In practice multiple joints can have a shared parent link.
-        But dealing with those special cases is not required in the homework.
+        The links form a tree given by the parent and child of each joint,
+        so multiple joints can have a shared parent link. Revolute joints
+        at the same depth of the tree (e.g. the shoulders of two arms)
+        are evaluated together.
 
-        The result is in robot frame, which means that the first link
+        The result is in robot frame, which means that the root link
         has (0, 0, 0) as translation and I as rotation matrix
 
         Here we assume each link's frame, except the first one,
@@ -48,13 +133,14 @@ class RobotModel:
         Parameters
         ----------
         qpos: np.ndarray
-            The current joint angles with shape (J,)
-            (which means its length is the number of revolute joints)
+            The current joint angles with shape (J,) or (B, J)
+            (which means its length is the number of revolute joints,
+            optionally with a batch of B configurations)
 
         Returns
         -------
         np.ndarray
-            The poses of links with shape (L, 4, 4)
+            The poses of links with shape (L, 4, 4) or (B, L, 4, 4)
             (which means its length is the number of links)
 
         Note
@@ -66,106 +152,269 @@ class RobotModel:
             0  1
         where R is rotation matrix and t is translation vector
         """
-        # 初始化所有连杆的位姿矩阵
+        qpos = np.asarray(qpos, dtype=float)
+        _, poses = self._fk_frames(qpos.reshape(-1, qpos.shape[-1]))
+        return poses.reshape(qpos.shape[:-1] + (len(self.links), 4, 4))
+
+    def jacobian(self, qpos: np.ndarray, link_name: str) -> np.ndarray:
+        """
+        Compute the geometric Jacobian of a link from a single fk pass.
+
+        Parameters
+        ----------
+        qpos: np.ndarray
+            The current joint angles with shape (J,) or (B, J)
+        link_name: str
+            The name of the link
+
+        Returns
+        -------
+        np.ndarray
+            The Jacobian with shape (6, J) or (B, 6, J), in robot frame.
+            The first three rows map joint velocities to the linear velocity
+            of the link origin and the last three rows to its angular velocity.
+            Columns of joints that don't move the link are zero.
+        """
+        qpos = np.asarray(qpos, dtype=float)
+        frames, poses = self._fk_frames(qpos.reshape(-1, qpos.shape[-1]))
+        link = [l.name for l in self.links].index(link_name)
+
+        # 旋转关节的轴绕自身旋转不变,所以在关节坐标系中就是 axis
+        axes = np.einsum("bjkl,jl->bjk", frames[:, 1:, :3, :3], self.revolute_axes)
+        origins = frames[:, 1:, :3, 3]
+        link_pos = poses[:, link, :3, 3]
+
+        mask = self.frame_ancestors[self.link_anchors[link]]
+        angular = axes * mask[:, None]
+        linear = np.cross(angular, link_pos[:, None] - origins)
+        jac = np.concatenate([linear, angular], axis=-1).swapaxes(-1, -2)
+        return jac.reshape(qpos.shape[:-1] + jac.shape[1:])
+
+    def _fk_frames(self, qpos: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Batched fk returning the revolute joint frames as well as the links.
+
+        Parameters
+        ----------
+        qpos: np.ndarray
+            The joint angles with shape (B, J)
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            The frames with shape (B, J + 1, 4, 4), where frames[:, 0] is
+            the root link and frames[:, j + 1] is revolute joint j after
+            applying qpos[:, j], and the link poses with shape (B, L, 4, 4)
+        """
+        batch_size, num_revolute = qpos.shape
+
+        # 所有旋转关节的罗德里格斯公式一次性求值 (B, J, 3, 3)
+        cos_theta = np.cos(qpos)[..., None, None]
+        sin_theta = np.sin(qpos)[..., None, None]
+        R = np.eye(3) + sin_theta * self.revolute_skew + (1 - cos_theta) * self.revolute_skew_sq
+
+        # 每个旋转关节的局部变换 = 之前合并的固定变换 * 关节旋转
+        rot = np.pad(R, [(0, 0), (0, 0), (0, 1), (0, 1)])
+        rot[..., 3, 3] = 1.0
+        local = self.chain_offsets @ rot
+
+        # 按树的深度逐层累乘,同一层的兄弟分支一起计算
+        frames = np.empty((batch_size, num_revolute + 1, 4, 4))
+        frames[:, 0] = np.eye(4)
+        for level in self.revolute_levels:
+            frames[:, level + 1] = frames[:, self.revolute_parents[level]] @ local[:, level]
+
+        # 每个连杆相对于其所挂的旋转关节坐标系有一个常量偏移
+        poses = frames[:, self.link_anchors] @ self.link_offsets
+        return frames, poses
+
+    def compile_chain(self):
+        """
+        Precompute the constant parts of the kinematic tree for fk.
+
+        Fixed joints between two revolute joints are collapsed into one
+        transform, so fk only needs one matrix product per revolute joint.
+
+        After calling this, the following arrays are available:
+
+        - revolute_joint_indices: (J,) index into self.joints of the joint
+          driven by qpos[j]
+        - revolute_axes: (J, 3) rotation axes of the revolute joints
+        - revolute_skew, revolute_skew_sq: (J, 3, 3) skew matrices K of the
+          axes and K @ K, used by Rodrigues' formula
+        - revolute_parents: (J,) the frame revolute joint j is attached to,
+          0 for the root link and k + 1 for revolute joint k
+        - revolute_levels: list of arrays of revolute joints with the same
+          depth in the tree, in increasing depth
+        - chain_offsets: (J, 4, 4) constant transform from the parent frame
+          to the origin of revolute joint j
+        - frame_ancestors: (J + 1, J) whether revolute joint j moves
+          frame f, i.e. is f itself or one of its ancestors
+        - link_anchors: (L,) which frame each link hangs off,
+          0 for the root link and j + 1 for revolute joint j
+        - link_offsets: (L, 4, 4) constant transform from the anchor frame
+          to the link
+        """
         num_links = len(self.links)
-        poses = np.zeros((num_links, 4, 4))
-        
-        # 设置第一个连杆的位姿为单位矩阵（位于原点，无旋转）
-        poses[0, :, :] = np.eye(4)
-        
-        # 旋转关节计数器（用于索引qpos数组）
-        revolute_joint_idx = 0
-        
-        # 计算每个连杆的位姿
-        for i in range(1, num_links):
-            # 获取当前连杆的父关节（即第i-1个关节）
-            joint = self.joints[i-1]
-            
-            # 获取父连杆的位姿
-            parent_pose = poses[i-1]
-            
-            # 创建关节的变换矩阵
+        self.revolute_joint_indices = np.array(
+            [i for i, j in enumerate(self.joints) if isinstance(j, RevoluteJoint)],
+            dtype=int,
+        )
+        num_revolute = len(self.revolute_joint_indices)
+        self.revolute_axes = np.array(
+            [self.joints[i].axis for i in self.revolute_joint_indices]
+        ).reshape(-1, 3)
+
+        x, y, z = self.revolute_axes.T
+        zero = np.zeros_like(x)
+        self.revolute_skew = np.stack([
+            np.stack([zero, -z, y], axis=-1),
+            np.stack([z, zero, -x], axis=-1),
+            np.stack([-y, x, zero], axis=-1),
+        ], axis=-2)
+        self.revolute_skew_sq = self.revolute_skew @ self.revolute_skew
+
+        link_index = {l.name: i for i, l in enumerate(self.links)}
+        revolute_index = {
+            self.joints[i].name: j for j, i in enumerate(self.revolute_joint_indices)
+        }
+        _, joint_names = sort_kinematic_tree(self.links, self.joints, self.joint_links)
+        joints = {j.name: j for j in self.joints}
+
+        self.revolute_parents = np.zeros(num_revolute, dtype=int)
+        self.chain_offsets = np.zeros((num_revolute, 4, 4))
+        self.link_anchors = np.zeros(num_links, dtype=int)
+        self.link_offsets = np.tile(np.eye(4), (num_links, 1, 1))
+        self.frame_ancestors = np.zeros((num_revolute + 1, num_revolute), dtype=bool)
+        # 每个坐标系在树中的深度,根连杆为0
+        frame_depth = np.zeros(num_revolute + 1, dtype=int)
+        # 按拓扑序遍历,保证父连杆先于子连杆处理
+        for joint_name in joint_names:
+            joint = joints[joint_name]
+            parent, child = (link_index[l] for l in self.joint_links[joint_name])
             joint_transform = np.eye(4)
-            
-            # 设置关节的旋转和平移
             joint_transform[:3, :3] = joint.rot
             joint_transform[:3, 3] = joint.trans
-            
-            # 如果是旋转关节，需要应用关节角度
+            # offset 是子连杆相对于最近一个祖先旋转关节坐标系的固定变换
+            offset = self.link_offsets[parent] @ joint_transform
             if isinstance(joint, RevoluteJoint):
-                # 获取当前关节角度
-                angle = qpos[revolute_joint_idx]
-                revolute_joint_idx += 1
-                
-                # 计算旋转轴的旋转矩阵
-                axis = joint.axis
-                # 创建旋转矩阵（罗德里格斯公式）
-                cos_theta = np.cos(angle)
-                sin_theta = np.sin(angle)
-                K = np.array([
-                    [0, -axis[2], axis[1]],
-                    [axis[2], 0, -axis[0]],
-                    [-axis[1], axis[0], 0]
-                ])
-                R = np.eye(3) + sin_theta * K + (1 - cos_theta) * (K @ K)
-                
-                # 应用关节角度旋转
-                rot_matrix = np.eye(4)
-                rot_matrix[:3, :3] = R
-                joint_transform = joint_transform @ rot_matrix
-            
-            # 计算当前连杆的位姿 = 父连杆位姿 * 关节变换
-            poses[i] = parent_pose @ joint_transform
-            
-        return poses
+                j = revolute_index[joint.name]
+                self.revolute_parents[j] = self.link_anchors[parent]
+                self.chain_offsets[j] = offset
+                frame_depth[j + 1] = frame_depth[self.link_anchors[parent]] + 1
+                self.frame_ancestors[j + 1] = self.frame_ancestors[self.link_anchors[parent]]
+                self.frame_ancestors[j + 1, j] = True
+                self.link_anchors[child] = j + 1
+            else:
+                self.link_anchors[child] = self.link_anchors[parent]
+                self.link_offsets[child] = offset
+        revolute_depth = frame_depth[1:]
+        self.revolute_levels = [
+            np.flatnonzero(revolute_depth == d)
+            for d in range(1, revolute_depth.max(initial=0) + 1)
+        ]
 
     def load_urdf(self, robot_cfg: RobotConfig):
         """
         Load the URDF into this RobotModel
 
-        Theoretically one can write a general code that load
-        everything only from the URDF, but it will make the
-        code too complex. Thus we read the joints' name and
-        links' name from the RobotConfig instead.
+        The kinematic tree is read from the parent and child of each
+        joint in the URDF. The order of the links and joints follows
+        RobotConfig.link_names and RobotConfig.joint_names if they are
+        given, otherwise the topological order of the tree is used.
+
+        If robot_cfg has a cache_dir attribute that is not None, the parsed
+        and compiled model is stored there keyed by the hash of the URDF
+        content, and later loads of the same URDF read it back without
+        parsing. It is not a field of RobotConfig, set it on the instance.
 
         Parameters
         ----------
         robot_cfg : RobotConfig
             The configuration of the robot
         """
-        self.links = [None for _ in robot_cfg.link_names]
-        self.joints = [None for _ in robot_cfg.joint_names]
-        tree = ET.parse(robot_cfg.urdf_path)
-        root = tree.getroot()
-        for child in root:
-            if child.tag == "link":
-                idx = robot_cfg.link_names.index(child.attrib["name"])
-                self.links[idx] = Link(
-                    name=child.attrib["name"],
-                    visual_meshes=[
-                        os.path.join(
-                            os.path.dirname(robot_cfg.urdf_path), m.attrib["filename"]
-                        )
-                        for m in child.findall("./visual/geometry/mesh")
-                    ],
-                )
-            elif child.tag == "joint":
-                idx = robot_cfg.joint_names.index(child.attrib["name"])
-                joint_type = child.attrib["type"]
-                kwargs = dict(
-                    name=child.attrib["name"],
-                    trans=str_to_np(child.find("origin").attrib["xyz"]),
-                    rot=rpy_to_mat(str_to_np(child.find("origin").attrib["rpy"])),
+        cache_dir = getattr(robot_cfg, "cache_dir", None)
+        cache_path = None
+        if cache_dir is not None:
+            cache_path = os.path.join(cache_dir, f"{urdf_cache_key(robot_cfg)}.pkl")
+            if os.path.exists(cache_path):
+                with open(cache_path, "rb") as f:
+                    self.__dict__.update(pickle.load(f))
+                return
+
+        urdf_dir = os.path.dirname(robot_cfg.urdf_path)
+        root = ET.parse(robot_cfg.urdf_path).getroot()
+        links = {
+            child.attrib["name"]: Link(
+                name=child.attrib["name"],
+                visual_meshes=[
+                    os.path.join(urdf_dir, m.attrib["filename"])
+                    for m in child.findall("./visual/geometry/mesh")
+                ],
+            )
+            for child in root.findall("link")
+        }
+
+        # 所有关节的 origin 和 axis 拼接后一次性解析,旋转矩阵也批量计算
+        joint_elems = root.findall("joint")
+        origins = []
+        for child in joint_elems:
+            origin = child.find("origin")
+            origin = dict() if origin is None else origin.attrib
+            origins.append(f'{origin.get("xyz", "0 0 0")} {origin.get("rpy", "0 0 0")}')
+        origins = str_to_np(" ".join(origins)).reshape(-1, 6)
+        rots = rpy_to_mat(origins[:, 3:])
+        axes = str_to_np(
+            " ".join(
+                "1 0 0" if child.find("axis") is None else child.find("axis").attrib["xyz"]
+                for child in joint_elems
+            )
+        ).reshape(-1, 3)
+
+        # 父子连杆单独记录,urdf_types.Joint 中没有这两个字段
+        joints, self.joint_links = dict(), dict()
+        for i, child in enumerate(joint_elems):
+            joint_type = child.attrib["type"]
+            self.joint_links[child.attrib["name"]] = (
+                child.find("parent").attrib["link"],
+                child.find("child").attrib["link"],
+            )
+            kwargs = dict(
+                name=child.attrib["name"],
+                trans=origins[i, :3],
+                rot=rots[i],
+            )
+            if joint_type == "fixed":
+                joints[child.attrib["name"]] = FixedJoint(**kwargs)
+            elif joint_type == "revolute":
+                joints[child.attrib["name"]] = RevoluteJoint(
+                    axis=axes[i],
+                    lower_limit=float(child.find("limit").attrib["lower"]),
+                    upper_limit=float(child.find("limit").attrib["upper"]),
+                    **kwargs
                 )
-                if joint_type == "fixed":
-                    self.joints[idx] = FixedJoint(**kwargs)
-                elif joint_type == "revolute":
-                    self.joints[idx] = RevoluteJoint(
-                        axis=str_to_np(child.find("axis").attrib["xyz"]),
-                        lower_limit=float(child.find("limit").attrib["lower"]),
-                        upper_limit=float(child.find("limit").attrib["upper"]),
-                        **kwargs
-                    )
+            else:
+                raise NotImplementedError(f"Joint type {joint_type} not supported.")
+
+        link_names, joint_names = robot_cfg.link_names, robot_cfg.joint_names
+        if link_names is None or joint_names is None:
+            tree_link_names, tree_joint_names = sort_kinematic_tree(
+                list(links.values()), list(joints.values()), self.joint_links
+            )
+            link_names = tree_link_names if link_names is None else link_names
+            joint_names = tree_joint_names if joint_names is None else joint_names
+        self.links = [links[name] for name in link_names]
+        self.joints = [joints[name] for name in joint_names]
+        self.compile_chain()
+
+        if cache_path is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            state = {k: v for k, v in self.__dict__.items() if k != "robot_cfg"}
+            # 先写临时文件再重命名,避免并发加载时读到不完整的缓存
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(state, f)
+            os.replace(tmp_path, cache_path)
 
     def vis(self, poses: np.ndarray, color: str) -> list:
         """
@@ -192,6 +441,51 @@ class RobotModel:
                 vis_list += Vis.mesh(path=m, trans=p[:3, 3], rot=p[:3, :3], color=color)
         return vis_list
 
+    def vis_trajectory(
+        self, poses: np.ndarray, color: str, animate_meshes: bool = True
+    ) -> Tuple[list, List[List[dict]]]:
+        """
+        A helper function to visualize a trajectory of fk results with plotly.
+
+        The link frames are always animated. The meshes of moving links
+        carry their vertices in every frame, the ones of links that don't
+        move are drawn once (see Vis.mesh_trajectory). For long
+        trajectories set animate_meshes to False to draw all meshes at the
+        first pose only and keep the html file small.
+
+        Parameters
+        ----------
+        poses: np.ndarray
+            The poses of each link along the trajectory with shape (T, L, 4, 4)
+
+        color: str (or any other format supported by plotly)
+            The color of the meshes shown in visualization
+
+        animate_meshes: bool
+            Whether the meshes follow the trajectory or stay at the first pose
+
+        Returns
+        -------
+        A list of plotly objects and their frame updates that can be
+        shown in Vis.show_animation
+        """
+        vis_list, updates, static_list = [], [], []
+        for i, l in enumerate(self.links):
+            trans, rot = poses[:, i, :3, 3], poses[:, i, :3, :3]
+            v, u = Vis.pose_trajectory(trans, rot)
+            vis_list, updates = vis_list + v, updates + u
+            for m in l.visual_meshes:
+                if animate_meshes:
+                    v, u = Vis.mesh_trajectory(path=m, trans=trans, rot=rot, color=color)
+                    if len(u):
+                        vis_list, updates = vis_list + v, updates + u
+                    else:
+                        static_list += v
+                else:
+                    static_list += Vis.mesh(path=m, trans=trans[0], rot=rot[0], color=color)
+        # static objects go last, Vis.show_animation only updates the first len(updates)
+        return vis_list + static_list, updates
+
 
 if __name__ == "__main__":
     # a simple test to check if the code is working
@@ -1,3 +1,4 @@
+from typing import Optional, Tuple, Union
 import numpy as np
 
 
@@ -8,17 +9,20 @@ def quat_normalize(q: np.ndarray) -> np.ndarray:
     Parameters
     ----------
     q: np.ndarray
-        Unnormalized quaternion with shape (4,)
+        Unnormalized quaternion with shape (..., 4)
 
     Returns
     -------
     np.ndarray
-        Normalized quaternion with shape (4,)
+        Normalized quaternion with shape (..., 4)
     """
-    norm = np.linalg.norm(q)
-    if norm < 1e-10:
-        return np.array([1.0, 0.0, 0.0, 0.0])  # 返回单位四元数(相当于没有旋转)
-    return q / norm
+    q = np.asarray(q, dtype=float)
+    norm = np.linalg.norm(q, axis=-1, keepdims=True)
+    degenerate = norm < 1e-10
+    # 模长过小时返回单位四元数(相当于没有旋转)
+    identity = np.zeros_like(q)
+    identity[..., 0] = 1.0
+    return np.where(degenerate, identity, q / np.where(degenerate, 1.0, norm))
 
 
 def quat_conjugate(q: np.ndarray) -> np.ndarray:
@@ -28,15 +32,15 @@ def quat_conjugate(q: np.ndarray) -> np.ndarray:
     Parameters
     ----------
     q: np.ndarray
-        Quaternion with shape (4,)
+        Quaternion with shape (..., 4)
 
     Returns
     -------
     np.ndarray
-        The conjugate of the quaternion with shape (4,)
+        The conjugate of the quaternion with shape (..., 4)
     """
     # 四元数共轭:保持实部不变,虚数向量部分取反
-    return np.array([q[0], -q[1], -q[2], -q[3]])
+    return np.asarray(q, dtype=float) * np.array([1.0, -1.0, -1.0, -1.0])
 
 
 def quat_multiply(q1: np.ndarray, q2: np.ndarray) -> np.ndarray:
@@ -47,22 +51,22 @@ def quat_multiply(q1: np.ndarray, q2: np.ndarray) -> np.ndarray:
     Parameters
     ----------
     q1, q2: np.ndarray
-        Quaternions with shape (4,)
+        Quaternions with shape (..., 4), the batch dimensions are broadcast
 
     Returns
     -------
     np.ndarray
-        The multiplication result with shape (4,)
+        The multiplication result with shape (..., 4)
     """
-    w1, x1, y1, z1 = q1
-    w2, x2, y2, z2 = q2
+    w1, x1, y1, z1 = np.moveaxis(np.asarray(q1, dtype=float), -1, 0)
+    w2, x2, y2, z2 = np.moveaxis(np.asarray(q2, dtype=float), -1, 0)
     
     w = w1 * w2 - x1 * x2 - y1 * y2 - z1 * z2
     x = w1 * x2 + x1 * w2 + y1 * z2 - z1 * y2
     y = w1 * y2 - x1 * z2 + y1 * w2 + z1 * x2
     z = w1 * z2 + x1 * y2 - y1 * x2 + z1 * w2
     
-    return np.array([w, x, y, z])
+    return np.stack([w, x, y, z], axis=-1)
 
 
 def quat_rotate(q: np.ndarray, v: np.ndarray) -> np.ndarray:
@@ -72,27 +76,35 @@ def quat_rotate(q: np.ndarray, v: np.ndarray) -> np.ndarray:
     Parameters
     ----------
     q: np.ndarray
-        Quaternion with shape (4,)
+        Quaternion with shape (..., 4)
     v: np.ndarray
-        Vector with shape (3,)
+        Vector with shape (..., 3), the batch dimensions are broadcast with q
 
     Returns
     -------
     np.ndarray
-        The rotated vector with shape (3,)
+        The rotated vector with shape (..., 3)
+
+    Note
+    ----
+    A single quaternion applied to many vectors (e.g. a (M, 3) point cloud)
+    is converted to a rotation matrix once and applied with one matrix product.
+    Otherwise the closed form v + 2w(u x v) + 2u x (u x v) is used, where
+    (w, u) are the scalar and vector parts of q, so no intermediate
+    quaternion products are built.
     """
     # 确保四元数是单位四元数
     q = quat_normalize(q)
+    v = np.asarray(v, dtype=float)
     
-    # 将向量转换为纯四元数 (0, v)
-    v_quat = np.array([0, v[0], v[1], v[2]])
-    
-    # 执行 q * v * q^(-1) 旋转,其中q^(-1)表示q的共轭
-    q_conj = quat_conjugate(q)
-    rotated = quat_multiply(quat_multiply(q, v_quat), q_conj)
+    # 单个四元数旋转大量向量时,先转换为旋转矩阵再做一次矩阵乘法
+    if q.ndim == 1 and v.ndim > 1:
+        return v @ quat_to_mat(q).T
     
-    # 返回旋转后的向量
-    return rotated[1:]
+    # 等价于 q * (0, v) * q^(-1) 的闭式解,避免两次四元数乘法
+    w, u = q[..., :1], q[..., 1:]
+    uv = np.cross(u, v)
+    return v + 2.0 * (w * uv + np.cross(u, uv))
 
 
 def quat_relative_angle(q1: np.ndarray, q2: np.ndarray) -> float:
@@ -102,12 +114,13 @@ def quat_relative_angle(q1: np.ndarray, q2: np.ndarray) -> float:
     Parameters
     ----------
     q1, q2: np.ndarray
-        Quaternions with shape (4,)
+        Quaternions with shape (..., 4), the batch dimensions are broadcast
 
     Returns
     -------
-    float
-        The relative rotation angle in radians, greater than or equal to 0.
+    float or np.ndarray
+        The relative rotation angle in radians, greater than or equal to 0,
+        with the broadcast batch shape (a scalar for single quaternions).
     """
     # 确保输入是单位四元数
     q1 = quat_normalize(q1)
@@ -117,14 +130,13 @@ def quat_relative_angle(q1: np.ndarray, q2: np.ndarray) -> float:
     q_rel = quat_multiply(q2, quat_conjugate(q1))
     
     # 从相对四元数中提取角度
-    cos_theta = np.clip(q_rel[0], -1.0, 1.0)
+    cos_theta = np.clip(q_rel[..., 0], -1.0, 1.0)
     angle = 2 * np.arccos(cos_theta)
     
     # 确保角度在 [0, π] 范围内
-    if angle > np.pi:
-        angle = 2 * np.pi - angle
+    angle = np.where(angle > np.pi, 2 * np.pi - angle, angle)
     
-    return angle
+    return angle[()]
 
 
 def interpolate_quat(q1: np.ndarray, q2: np.ndarray, ratio: float) -> np.ndarray:
@@ -140,14 +152,15 @@ def interpolate_quat(q1: np.ndarray, q2: np.ndarray, ratio: float) -> np.ndarray
     Parameters
     ----------
     q1, q2: np.ndarray
-        Quaternions with shape (4,)
-    ratio: float
-        The ratio of interpolation, should be in [0, 1]
+        Quaternions with shape (..., 4), the batch dimensions are broadcast
+    ratio: float or np.ndarray
+        The ratio of interpolation, should be in [0, 1].
+        An array of shape (...) is broadcast against the batch dimensions.
 
     Returns
     -------
     np.ndarray
-        The interpolated quaternion with shape (4,)
+        The interpolated quaternion with shape (..., 4)
 
     Note
     ----
@@ -157,23 +170,23 @@ def interpolate_quat(q1: np.ndarray, q2: np.ndarray, ratio: float) -> np.ndarray
     q1 = quat_normalize(q1)
     q2 = quat_normalize(q2)
     
+    ratio = np.asarray(ratio, dtype=float)[..., None]
+    
     # 计算四元数的点积
-    dot = np.sum(q1 * q2)
+    dot = np.sum(q1 * q2, axis=-1, keepdims=True)
     
     # 如果点积为负,取其中一个四元数的负值
     # 这确保我们沿着最短路径进行插值
-    if dot < 0:
-        q2 = -q2
-        dot = -dot
+    q2 = np.where(dot < 0, -q2, q2)
+    dot = np.abs(dot)
     
     # 如果四元数几乎相同,直接线性插值并归一化
-    if dot > 0.9995:
-        result = q1 + ratio * (q2 - q1)
-        return quat_normalize(result)
+    parallel = dot > 0.9995
+    lerp = quat_normalize(q1 + ratio * (q2 - q1))
     
     # 执行球面线性插值 (SLERP)
-    theta_0 = np.arccos(dot)
-    sin_theta_0 = np.sin(theta_0)
+    theta_0 = np.arccos(np.minimum(dot, 1.0))
+    sin_theta_0 = np.where(parallel, 1.0, np.sin(theta_0))
     
     theta = theta_0 * ratio
     sin_theta = np.sin(theta)
@@ -181,7 +194,37 @@ def interpolate_quat(q1: np.ndarray, q2: np.ndarray, ratio: float) -> np.ndarray
     s0 = np.cos(theta) - dot * sin_theta / sin_theta_0
     s1 = sin_theta / sin_theta_0
     
-    return s0 * q1 + s1 * q2
+    return np.where(parallel, lerp, s0 * q1 + s1 * q2)
+
+
+def interpolate_quat_trajectory(
+    q1: np.ndarray, q2: np.ndarray, ratios: np.ndarray
+) -> np.ndarray:
+    """
+    Interpolate between two quaternions at many ratios in one call.
+
+    This is equivalent to calling interpolate_quat once per ratio, but the
+    normalization, short-arc sign flip and arccos are evaluated only once per
+    pair of keyframes and then shared by all the ratios.
+
+    Parameters
+    ----------
+    q1, q2: np.ndarray
+        Keyframe quaternions with shape (..., 4), e.g. (4,) for a single
+        pair or (K, 4) for K pairs of keyframes
+    ratios: np.ndarray
+        The ratios of interpolation with shape (T,), or (..., T) to use
+        different ratios for each pair of keyframes
+
+    Returns
+    -------
+    np.ndarray
+        The interpolated trajectory with shape (..., T, 4)
+    """
+    q1 = np.asarray(q1, dtype=float)[..., None, :]
+    q2 = np.asarray(q2, dtype=float)[..., None, :]
+    # 关键帧相关的量只在长度为1的轴上计算,之后对所有ratio广播
+    return interpolate_quat(q1, q2, ratios)
 
 
 def quat_to_mat(q: np.ndarray) -> np.ndarray:
@@ -191,32 +234,32 @@ def quat_to_mat(q: np.ndarray) -> np.ndarray:
     Parameters
     ----------
     q: np.ndarray
-        Quaternion with shape (4,)
+        Quaternion with shape (..., 4)
 
     Returns
     -------
     np.ndarray
-        The rotation matrix with shape (3, 3)
+        The rotation matrix with shape (..., 3, 3)
     """
     # 确保输入是单位四元数
     q = quat_normalize(q)
-    w, x, y, z = q
+    w, x, y, z = np.moveaxis(q, -1, 0)
     
     # 构建旋转矩阵
-    R = np.zeros((3, 3))
+    R = np.zeros(q.shape[:-1] + (3, 3))
     
     # 填充旋转矩阵的元素
-    R[0, 0] = 1 - 2 * (y**2 + z**2)
-    R[0, 1] = 2 * (x * y - w * z)
-    R[0, 2] = 2 * (x * z + w * y)
+    R[..., 0, 0] = 1 - 2 * (y**2 + z**2)
+    R[..., 0, 1] = 2 * (x * y - w * z)
+    R[..., 0, 2] = 2 * (x * z + w * y)
     
-    R[1, 0] = 2 * (x * y + w * z)
-    R[1, 1] = 1 - 2 * (x**2 + z**2)
-    R[1, 2] = 2 * (y * z - w * x)
+    R[..., 1, 0] = 2 * (x * y + w * z)
+    R[..., 1, 1] = 1 - 2 * (x**2 + z**2)
+    R[..., 1, 2] = 2 * (y * z - w * x)
     
-    R[2, 0] = 2 * (x * z - w * y)
-    R[2, 1] = 2 * (y * z + w * x)
-    R[2, 2] = 1 - 2 * (x**2 + y**2)
+    R[..., 2, 0] = 2 * (x * z - w * y)
+    R[..., 2, 1] = 2 * (y * z + w * x)
+    R[..., 2, 2] = 1 - 2 * (x**2 + y**2)
     
     return R
 
@@ -228,42 +271,34 @@ def mat_to_quat(mat: np.ndarray) -> np.ndarray:
     Parameters
     ----------
     mat: np.ndarray
-        The rotation matrix with shape (3, 3)
+        The rotation matrix with shape (..., 3, 3)
 
     Returns
     -------
     np.ndarray
-        The quaternion with shape (4,)
+        The quaternion with shape (..., 4)
     """
     # 使用Shepperd的方法从旋转矩阵提取四元数
-    trace = np.trace(mat)
-    
-    if trace > 0:
-        s = 0.5 / np.sqrt(trace + 1.0)
-        w = 0.25 / s
-        x = (mat[2, 1] - mat[1, 2]) * s
-        y = (mat[0, 2] - mat[2, 0]) * s
-        z = (mat[1, 0] - mat[0, 1]) * s
-    elif mat[0, 0] > mat[1, 1] and mat[0, 0] > mat[2, 2]:
-        s = 2.0 * np.sqrt(1.0 + mat[0, 0] - mat[1, 1] - mat[2, 2])
-        w = (mat[2, 1] - mat[1, 2]) / s
-        x = 0.25 * s
-        y = (mat[0, 1] + mat[1, 0]) / s
-        z = (mat[0, 2] + mat[2, 0]) / s
-    elif mat[1, 1] > mat[2, 2]:
-        s = 2.0 * np.sqrt(1.0 + mat[1, 1] - mat[0, 0] - mat[2, 2])
-        w = (mat[0, 2] - mat[2, 0]) / s
-        x = (mat[0, 1] + mat[1, 0]) / s
-        y = 0.25 * s
-        z = (mat[1, 2] + mat[2, 1]) / s
-    else:
-        s = 2.0 * np.sqrt(1.0 + mat[2, 2] - mat[0, 0] - mat[1, 1])
-        w = (mat[1, 0] - mat[0, 1]) / s
-        x = (mat[0, 2] + mat[2, 0]) / s
-        y = (mat[1, 2] + mat[2, 1]) / s
-        z = 0.25 * s
-    
-    return quat_normalize(np.array([w, x, y, z]))
+    # 四个分支的候选值同时计算,每个矩阵按数值最稳定的分支选取,无需Python分支
+    mat = np.asarray(mat, dtype=float)
+    m00, m01, m02 = mat[..., 0, 0], mat[..., 0, 1], mat[..., 0, 2]
+    m10, m11, m12 = mat[..., 1, 0], mat[..., 1, 1], mat[..., 1, 2]
+    m20, m21, m22 = mat[..., 2, 0], mat[..., 2, 1], mat[..., 2, 2]
+    trace = m00 + m11 + m22
+    
+    # 第k行等于 4 * q_k * q, 对角线元素为 4 * q_k^2
+    candidates = np.stack([
+        np.stack([1.0 + trace, m21 - m12, m02 - m20, m10 - m01], axis=-1),
+        np.stack([m21 - m12, 1.0 + 2 * m00 - trace, m01 + m10, m02 + m20], axis=-1),
+        np.stack([m02 - m20, m01 + m10, 1.0 + 2 * m11 - trace, m12 + m21], axis=-1),
+        np.stack([m10 - m01, m02 + m20, m12 + m21, 1.0 + 2 * m22 - trace], axis=-1),
+    ], axis=-2)
+    
+    # 选择 |q_k| 最大的分支,避免除以接近0的数
+    branch = np.argmax(np.stack([trace, m00, m11, m22], axis=-1), axis=-1)
+    q = np.take_along_axis(candidates, branch[..., None, None], axis=-2)[..., 0, :]
+    
+    return quat_normalize(q)
 
 
 def mat_to_axis_angle(mat: np.ndarray) -> np.ndarray:
@@ -275,12 +310,12 @@ def mat_to_axis_angle(mat: np.ndarray) -> np.ndarray:
     Parameters
     ----------
     mat: np.ndarray
-        The rotation matrix with shape (3, 3)
+        The rotation matrix with shape (..., 3, 3)
 
     Returns
     -------
     np.ndarray
-        The axis-angle representation with shape (3,)
+        The axis-angle representation with shape (..., 3)
     """
     # 首先将旋转矩阵转换为四元数
     q = mat_to_quat(mat)
@@ -300,38 +335,39 @@ def quat_to_axis_angle(q: np.ndarray) -> np.ndarray:
     Parameters
     ----------
     q: np.ndarray
-        The quaternion with shape (4,)
+        The quaternion with shape (..., 4)
 
     Returns
     -------
     np.ndarray
-        The axis-angle representation with shape (3,)
+        The axis-angle representation with shape (..., 3)
     """
     # 确保输入是单位四元数
     q = quat_normalize(q)
-    w, x, y, z = q
+    w, xyz = q[..., :1], q[..., 1:]
     
     # 计算旋转角度
     angle = 2 * np.arccos(np.clip(w, -1.0, 1.0))
     
     # 如果角度接近0,返回零向量
-    if np.abs(angle) < 1e-10:
-        return np.zeros(3)
+    no_rotation = np.abs(angle) < 1e-10
     
     # 计算旋转轴
-    sin_half_angle = np.sqrt(1.0 - w * w)
-    if np.abs(sin_half_angle) < 1e-10:
-        axis = np.array([1.0, 0.0, 0.0])  # 任意轴，无旋转
-    else:
-        axis = np.array([x, y, z]) / sin_half_angle
+    sin_half_angle = np.sqrt(np.maximum(1.0 - w * w, 0.0))
+    no_axis = np.abs(sin_half_angle) < 1e-10
+    axis = np.where(
+        no_axis,
+        np.array([1.0, 0.0, 0.0]),  # 任意轴，无旋转
+        xyz / np.where(no_axis, 1.0, sin_half_angle),
+    )
     
     # 确保角度不超过π
-    if angle > np.pi:
-        angle = 2 * np.pi - angle
-        axis = -axis
+    flip = angle > np.pi
+    angle = np.where(flip, 2 * np.pi - angle, angle)
+    axis = np.where(flip, -axis, axis)
     
     # 返回轴角表示
-    return axis * angle
+    return np.where(no_rotation, 0.0, axis * angle)
 
 
 def axis_angle_to_quat(aa: np.ndarray) -> np.ndarray:
@@ -343,33 +379,32 @@ def axis_angle_to_quat(aa: np.ndarray) -> np.ndarray:
     Parameters
     ----------
     aa: np.ndarray
-        The axis-angle representation with shape (3,)
+        The axis-angle representation with shape (..., 3)
 
     Returns
     -------
     np.ndarray
-        The quaternion with shape (4,)
+        The quaternion with shape (..., 4)
     """
     # 计算旋转角度(轴角向量的长度)
-    angle = np.linalg.norm(aa)
+    aa = np.asarray(aa, dtype=float)
+    angle = np.linalg.norm(aa, axis=-1, keepdims=True)
     
     # 如果角度接近0,返回单位四元数
-    if angle < 1e-10:
-        return np.array([1.0, 0.0, 0.0, 0.0])
+    no_rotation = angle < 1e-10
     
     # 计算旋转轴
-    axis = aa / angle
+    axis = aa / np.where(no_rotation, 1.0, angle)
     
     # 计算四元数分量
     half_angle = angle / 2.0
     sin_half_angle = np.sin(half_angle)
     
     w = np.cos(half_angle)
-    x = axis[0] * sin_half_angle
-    y = axis[1] * sin_half_angle
-    z = axis[2] * sin_half_angle
+    xyz = axis * sin_half_angle
     
-    return np.array([w, x, y, z])
+    identity = np.array([1.0, 0.0, 0.0, 0.0])
+    return np.where(no_rotation, identity, np.concatenate([w, xyz], axis=-1))
 
 
 def axis_angle_to_mat(aa: np.ndarray) -> np.ndarray:
@@ -379,12 +414,12 @@ def axis_angle_to_mat(aa: np.ndarray) -> np.ndarray:
     Parameters
     ----------
     aa: np.ndarray
-        The axis-angle representation with shape (3,)
+        The axis-angle representation with shape (..., 3)
 
     Returns
     -------
     np.ndarray
-        The rotation matrix with shape (3, 3)
+        The rotation matrix with shape (..., 3, 3)
     """
     # 首先将轴角表示转换为四元数
     q = axis_angle_to_quat(aa)
@@ -393,17 +428,23 @@ def axis_angle_to_mat(aa: np.ndarray) -> np.ndarray:
     return quat_to_mat(q)
 
 
-def uniform_random_quat() -> np.ndarray:
+def uniform_random_quat(size: Optional[Union[int, Tuple[int, ...]]] = None) -> np.ndarray:
     """
     Generate a random quaternion with uniform distribution.
 
+    Parameters
+    ----------
+    size: Optional[Union[int, Tuple[int, ...]]]
+        The batch shape of the samples, None for a single quaternion
+
     Returns
     -------
     np.ndarray
-        The random quaternion with shape (4,)
+        The random quaternion with shape (4,), or (*size, 4) if size is given
     """
     # 使用Marsaglia方法生成均匀分布的随机四元数
-    u1, u2, u3 = np.random.random(3)
+    size = () if size is None else np.atleast_1d(size).tolist()
+    u1, u2, u3 = np.random.random([3, *size])
     
     # 计算四元数分量
     sqrt_u1 = np.sqrt(u1)
@@ -417,7 +458,7 @@ def uniform_random_quat() -> np.ndarray:
     y = sqrt_u1 * np.sin(theta2)
     z = sqrt_u1 * np.cos(theta2)
     
-    return np.array([w, x, y, z])
+    return np.stack([w, x, y, z], axis=-1)
 
 
 def rpy_to_mat(rpy: np.ndarray) -> np.ndarray:
@@ -429,31 +470,35 @@ def rpy_to_mat(rpy: np.ndarray) -> np.ndarray:
     Parameters
     ----------
     rpy: np.ndarray
-        The euler angles with shape (3,)
+        The euler angles with shape (..., 3)
 
     Returns
     -------
     np.ndarray
-        The rotation matrix with shape (3, 3)
+        The rotation matrix with shape (..., 3, 3)
     """
-    roll, pitch, yaw = rpy
+    roll, pitch, yaw = np.moveaxis(np.asarray(rpy, dtype=float), -1, 0)
+    zero, one = np.zeros_like(roll), np.ones_like(roll)
+
+    def _stack(rows):
+        return np.stack([np.stack(r, axis=-1) for r in rows], axis=-2)
 
-    R_x = np.array([
-        [1, 0, 0],
-        [0, np.cos(roll), -np.sin(roll)],
-        [0, np.sin(roll), np.cos(roll)]
+    R_x = _stack([
+        [one, zero, zero],
+        [zero, np.cos(roll), -np.sin(roll)],
+        [zero, np.sin(roll), np.cos(roll)]
     ])
 
-    R_y = np.array([
-        [np.cos(pitch), 0, np.sin(pitch)],
-        [0, 1, 0],
-        [-np.sin(pitch), 0, np.cos(pitch)]
+    R_y = _stack([
+        [np.cos(pitch), zero, np.sin(pitch)],
+        [zero, one, zero],
+        [-np.sin(pitch), zero, np.cos(pitch)]
     ])
 
-    R_z = np.array([
-        [np.cos(yaw), -np.sin(yaw), 0],
-        [np.sin(yaw), np.cos(yaw), 0],
-        [0, 0, 1]
+    R_z = _stack([
+        [np.cos(yaw), -np.sin(yaw), zero],
+        [np.sin(yaw), np.cos(yaw), zero],
+        [zero, zero, one]
     ])
 
     R = R_z @ R_y @ R_x  # Matrix multiplication in ZYX order
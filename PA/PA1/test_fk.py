@@ -1,6 +1,13 @@
 import numpy as np
 from robot_model import RobotModel, RevoluteJoint
-from config import get_robot_config
+from config import RobotConfig, get_robot_config
+from rotation import axis_angle_to_mat
+
+
+def to_pose(trans):
+    pose = np.eye(4)
+    pose[:3, 3] = trans
+    return pose
 
 
 def test_fk():
@@ -15,3 +22,122 @@ def test_fk():
         for i in range(len(pose)):
             l, p1, p2 = rcfg.link_names[i], pose[i], my_pose[i]
             assert np.allclose(p1, p2), f"The first mismatch link is {l}: expected \n{p1}\n, got \n{p2}\n for qpos \n{qq}\n"
+
+
+def test_fk_batched():
+    data = np.load("data/fk.npz")
+    q = data["q"]
+    poses = data["poses"]
+    rm = RobotModel(get_robot_config("galbot"))
+    my_poses = rm.fk(q)
+    assert my_poses.shape == poses.shape
+    assert np.allclose(my_poses, poses)
+    assert np.allclose(rm.fk(q[:4].reshape(2, 2, -1)), poses[:4].reshape(2, 2, *poses.shape[1:]))
+
+
+def test_fk_urdf_order():
+    data = np.load("data/fk.npz")
+    rcfg = get_robot_config("galbot")
+    rm = RobotModel(RobotConfig(rcfg.urdf_path, None, None, None))
+    assert [l.name for l in rm.links] == rcfg.link_names
+    assert [j.name for j in rm.joints] == rcfg.joint_names
+    assert np.allclose(rm.fk(data["q"]), data["poses"])
+
+
+TREE_URDF = """<?xml version='1.0' encoding='UTF-8'?>
+<robot name="tree">
+    <link name="torso"/>
+    <link name="left"/>
+    <link name="left_tip"/>
+    <link name="right"/>
+    <link name="head"/>
+    <joint name="head_joint" type="revolute">
+        <limit lower="-1" upper="1"/>
+        <parent link="torso"/>
+        <child link="head"/>
+        <axis xyz="0 1 0"/>
+        <origin xyz="0 0 0.5" rpy="0 0 0"/>
+    </joint>
+    <joint name="left_tip_joint" type="fixed">
+        <parent link="left"/>
+        <child link="left_tip"/>
+        <origin xyz="0.3 0 0" rpy="0 0 0"/>
+    </joint>
+    <joint name="left_joint" type="revolute">
+        <limit lower="-1" upper="1"/>
+        <parent link="torso"/>
+        <child link="left"/>
+        <axis xyz="0 0 1"/>
+        <origin xyz="0 0.2 0" rpy="0 0 0"/>
+    </joint>
+    <joint name="right_joint" type="revolute">
+        <limit lower="-1" upper="1"/>
+        <parent link="torso"/>
+        <child link="right"/>
+        <axis xyz="1 0 0"/>
+        <origin xyz="0 -0.2 0" rpy="0 0 1.5707963267948966"/>
+    </joint>
+</robot>
+"""
+
+
+def test_fk_tree(tmp_path):
+    path = tmp_path / "tree.urdf"
+    path.write_text(TREE_URDF)
+    rm = RobotModel(RobotConfig(str(path), None, None, None))
+    names = [l.name for l in rm.links]
+    assert names[0] == "torso"
+    assert names.index("left") < names.index("left_tip")
+    assert len(rm.revolute_levels) == 1
+
+    qpos = np.random.uniform(-1, 1, (5, 3))
+    poses = rm.fk(qpos)
+    for q, pose in zip(qpos, poses):
+        joint_q = dict(zip([j.name for j in rm.joints if isinstance(j, RevoluteJoint)], q))
+        left = pose[names.index("left")]
+        assert np.allclose(left[:3, 3], [0, 0.2, 0])
+        assert np.allclose(left[:3, :3], axis_angle_to_mat(np.array([0, 0, joint_q["left_joint"]])))
+        assert np.allclose(pose[names.index("left_tip")], left @ to_pose([0.3, 0, 0]))
+        right = pose[names.index("right")]
+        assert np.allclose(right[:3, 3], [0, -0.2, 0])
+        assert np.allclose(
+            right[:3, :3],
+            axis_angle_to_mat(np.array([0, 0, np.pi / 2])) @ axis_angle_to_mat(np.array([joint_q["right_joint"], 0, 0])),
+        )
+        head = pose[names.index("head")]
+        assert np.allclose(head[:3, 3], [0, 0, 0.5])
+        assert np.allclose(head[:3, :3], axis_angle_to_mat(np.array([0, joint_q["head_joint"], 0])))
+
+
+def test_jacobian():
+    rm = RobotModel(get_robot_config("galbot"))
+    qpos = np.load("data/fk.npz")["q"][:8]
+    eps = 1e-6
+    for link in ["left_arm_link4", "left_gripper_tcp_link", "left_arm_base_link"]:
+        idx = [l.name for l in rm.links].index(link)
+        jac = rm.jacobian(qpos, link)
+        assert jac.shape == (len(qpos), 6, qpos.shape[1])
+        for q, J in zip(qpos, jac):
+            assert np.allclose(rm.jacobian(q, link), J)
+            pose = rm.fk(q)[idx]
+            for j in range(len(q)):
+                dq = np.zeros_like(q)
+                dq[j] = eps
+                pose_d = rm.fk(q + dq)[idx]
+                lin = (pose_d[:3, 3] - pose[:3, 3]) / eps
+                dR = (pose_d[:3, :3] - pose[:3, :3]) / eps @ pose[:3, :3].T
+                ang = np.array([dR[2, 1], dR[0, 2], dR[1, 0]])
+                assert np.allclose(J[:3, j], lin, atol=1e-4)
+                assert np.allclose(J[3:, j], ang, atol=1e-4)
+
+
+def test_urdf_cache(tmp_path):
+    data = np.load("data/fk.npz")
+    rcfg = get_robot_config("galbot")
+    rcfg.cache_dir = str(tmp_path)
+    RobotModel(rcfg)
+    assert len(list(tmp_path.glob("*.pkl"))) == 1
+    rm = RobotModel(rcfg)
+    assert rm.robot_cfg is rcfg
+    assert [l.name for l in rm.links] == rcfg.link_names
+    assert np.allclose(rm.fk(data["q"]), data["poses"])
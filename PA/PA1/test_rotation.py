@@ -6,6 +6,7 @@ from rotation import (
     quat_rotate,
     quat_relative_angle,
     interpolate_quat,
+    interpolate_quat_trajectory,
     quat_to_axis_angle,
     quat_to_mat,
     mat_to_axis_angle,
@@ -123,3 +124,82 @@ def test_uniform_random_quat():
         ratio = np.mean((rel_angle < threshold).astype(float))
         oracle = (threshold - np.sin(threshold)) / np.pi
         assert np.abs(ratio-oracle) < 0.025
+
+
+def test_batched_quat_ops():
+    data = np.load("data/quat_multiply.npz")
+    q1, q2 = data["q1"], data["q2"]
+    batch = quat_multiply(q1, q2)
+    assert batch.shape == q1.shape
+    for qq1, qq2, bb in zip(q1, q2, batch):
+        assert np.allclose(quat_multiply(qq1, qq2), bb)
+    assert np.allclose(quat_normalize(np.zeros((5, 4))), [1.0, 0.0, 0.0, 0.0])
+
+    data = np.load("data/quat_rotate.npz")
+    assert np.allclose(quat_rotate(data["q"], data["v"]), data["ans"])
+
+    data = np.load("data/quat_relative_angle.npz")
+    assert np.allclose(quat_relative_angle(data["q1"], data["q2"]), data["ans"])
+
+    data = np.load("data/interpolate_quat.npz")
+    batch = interpolate_quat(data["q1"], data["q2"], data["ratio"])
+    for qq1, qq2, rr, bb in zip(data["q1"], data["q2"], data["ratio"], batch):
+        assert np.allclose(interpolate_quat(qq1, qq2, rr), bb)
+
+
+def test_batched_transforms():
+    data = np.load("data/transform.npz")
+    q, mat, aa = data["q"], data["mat"], data["aa"]
+    shape = (10, 10)
+    q, mat, aa = q.reshape(shape + (4,)), mat.reshape(shape + (3, 3)), aa.reshape(shape + (3,))
+    assert np.allclose(quat_to_mat(q), mat)
+    assert np.allclose(axis_angle_to_mat(aa), mat)
+    assert np.allclose(np.abs(np.sum(mat_to_quat(mat) * q, axis=-1)), 1.0)
+    assert np.allclose(np.abs(np.sum(axis_angle_to_quat(aa) * q, axis=-1)), 1.0)
+    assert np.allclose(axis_angle_to_mat(mat_to_axis_angle(mat)), mat)
+    assert np.allclose(axis_angle_to_mat(quat_to_axis_angle(q)), mat)
+    for qq, mm in zip(q.reshape(-1, 4), mat.reshape(-1, 3, 3)):
+        assert np.allclose(mat_to_quat(mm), mat_to_quat(mm[None])[0])
+        assert np.allclose(quat_to_axis_angle(qq), quat_to_axis_angle(qq[None])[0])
+    assert uniform_random_quat(size=(3, 2)).shape == (3, 2, 4)
+
+
+def test_quat_rotate_broadcast():
+    data = np.load("data/quat_rotate.npz")
+    q, v, ans = data["q"], data["v"], data["ans"]
+    # one quaternion against a whole point cloud
+    for qq in q[:5]:
+        single = np.stack([quat_rotate(qq, vv) for vv in v])
+        assert np.allclose(quat_rotate(qq, v), single)
+    # many quaternions against many vectors
+    grid = quat_rotate(q[:, None], v[None])
+    assert grid.shape == (len(q), len(v), 3)
+    assert np.allclose(np.diagonal(grid, axis1=0, axis2=1).T, ans)
+
+
+def test_interpolate_quat_trajectory():
+    data = np.load("data/interpolate_quat.npz")
+    q1, q2 = data["q1"], data["q2"]
+    ratios = np.linspace(0, 1, 11)
+    traj = interpolate_quat_trajectory(q1, q2, ratios)
+    assert traj.shape == (len(q1), len(ratios), 4)
+    for qq1, qq2, tt in zip(q1, q2, traj):
+        assert np.allclose(interpolate_quat_trajectory(qq1, qq2, ratios), tt)
+        for rr, qq in zip(ratios, tt):
+            assert np.allclose(interpolate_quat(qq1, qq2, rr), qq)
+    # near-parallel keyframes fall back to normalized lerp
+    q = quat_normalize(np.array([1.0, 1e-3, 0.0, 0.0]))
+    traj = interpolate_quat_trajectory(q, -q, ratios)
+    assert np.allclose(np.abs(np.sum(traj * q, axis=-1)), 1.0)
+
+
+def test_mat_to_quat_batched_fk():
+    poses = np.load("data/fk.npz")["poses"]
+    mat = poses[..., :3, :3]
+    q = mat_to_quat(mat)
+    assert q.shape == mat.shape[:-2] + (4,)
+    assert np.allclose(quat_to_mat(q), mat)
+    # rotations by pi about each axis exercise the non-trace branches
+    flips = np.stack([np.diag([1.0, -1.0, -1.0]), np.diag([-1.0, 1.0, -1.0]), np.diag([-1.0, -1.0, 1.0])])
+    assert np.allclose(quat_to_mat(mat_to_quat(flips)), flips)
+    assert np.allclose(np.linalg.norm(mat_to_axis_angle(flips), axis=-1), np.pi)
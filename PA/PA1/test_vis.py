@@ -0,0 +1,46 @@
+import numpy as np
+from vis import Vis, load_mesh
+from rotation import axis_angle_to_mat
+
+MESH = "galbot/meshes/arm/visual/left_arm_link1.obj"
+
+
+def test_mesh_trajectory_frames():
+    T = 6
+    angles = np.zeros((T, 3))
+    angles[:, 2] = np.linspace(0, np.pi, T)
+    rot = axis_angle_to_mat(angles)
+    trans = np.linspace([0, 0, 0], [0.3, 0.1, 0.2], T)
+    vertices, faces = load_mesh(MESH)
+
+    vis_list, updates = Vis.mesh_trajectory(path=MESH, trans=trans, rot=rot)
+    assert len(vis_list) == 1 and len(updates) == 1 and len(updates[0]) == T
+    assert np.array_equal(vis_list[0].i, faces[:, 0])
+    for t, u in enumerate(updates[0]):
+        # only the transformed vertices go into the frames
+        assert set(u.keys()) == {"type", "x", "y", "z"}
+        assert u["x"].dtype == np.float32
+        expected = vertices @ rot[t].T + trans[t]
+        assert np.allclose(np.stack([u["x"], u["y"], u["z"]], axis=-1), expected, atol=1e-5)
+
+
+def test_mesh_trajectory_static():
+    T = 4
+    trans = np.tile([0.1, 0.2, 0.3], (T, 1))
+    rot = np.tile(np.eye(3), (T, 1, 1))
+    vis_list, updates = Vis.mesh_trajectory(path=MESH, trans=trans, rot=rot)
+    assert len(vis_list) == 1 and updates == []
+
+
+def test_show_animation(tmp_path):
+    T = 3
+    angles = np.zeros((T, 3))
+    angles[:, 0] = np.linspace(0, 1, T)
+    rot = axis_angle_to_mat(angles)
+    trans = np.zeros((T, 3))
+    vis_list, updates = Vis.pose_trajectory(trans, rot)
+    v, u = Vis.mesh_trajectory(path=MESH, trans=trans, rot=rot)
+    static, _ = Vis.mesh_trajectory(path=MESH, trans=trans + 1, rot=rot[:1].repeat(T, 0))
+    path = tmp_path / "anim.html"
+    Vis.show_animation(vis_list + v + static, updates + u, path=str(path))
+    assert path.exists()
@@ -1,10 +1,27 @@
 import os
-from typing import Optional
+from functools import lru_cache
+from typing import List, Optional, Tuple
 import trimesh as tm
 import numpy as np
 import plotly.graph_objects as go
 
 
+@lru_cache(maxsize=128)
+def load_mesh(path: str, scale: float = 1.0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Load the mesh file and scale it, the result is cached by path and scale
+
+    Returns
+    -------
+    The read-only vertices with shape (n, 3) and faces with shape (m, 3)
+    """
+    mesh = tm.load(path).apply_scale(scale)
+    vertices, faces = np.array(mesh.vertices), np.array(mesh.faces)
+    vertices.setflags(write=False)
+    faces.setflags(write=False)
+    return vertices, faces
+
+
 class Vis:
     """ """
 
@@ -125,10 +142,11 @@ class Vis:
         rot = np.eye(3) if rot is None else rot
 
         if path is not None:
-            mesh = tm.load(path).apply_scale(scale)
-            vertices, faces = mesh.vertices, mesh.faces
+            vertices, faces = load_mesh(path, scale)
+        else:
+            vertices = vertices * scale
 
-        v = np.einsum("ij,kj->ki", rot, vertices * scale) + trans
+        v = np.einsum("ij,kj->ki", rot, vertices) + trans
         f = faces
         mesh_plotly = go.Mesh3d(
             x=v[:, 0],
@@ -142,6 +160,179 @@ class Vis:
         )
         return [mesh_plotly]
 
+    @staticmethod
+    def mesh_trajectory(
+        path: str = None,
+        scale: float = 1.0,
+        trans: np.ndarray = None,  # (T, 3)
+        rot: np.ndarray = None,  # (T, 3, 3)
+        opacity: float = 1.0,
+        color: str = "orange",
+        vertices: Optional[np.ndarray] = None,  # (n, 3)
+        faces: Optional[np.ndarray] = None,  # (m, 3)
+    ) -> Tuple[list, List[List[dict]]]:
+        """
+        Visualize a mesh moving along a trajectory of T poses
+
+        The faces and colors are only stored once in the returned plotly
+        object and the frames only carry the transformed vertices, in
+        float32. plotly's Mesh3d has no transform attribute, so a moving
+        mesh still costs T times its number of vertices. A mesh that stays
+        at the same pose along the whole trajectory gets no frame updates
+        at all, and has to be placed after the animated objects in
+        Vis.show_animation.
+
+        Parameters
+        ----------
+        path: str
+            The path of the mesh file
+        scale: float
+            The scale of the mesh, default to be 1 (not change)
+        trans: np.ndarray
+            The translations of the mesh with shape (T, 3)
+        rot: np.ndarray
+            The rotations of the mesh with shape (T, 3, 3)
+        opacity: float
+            The opacity of the mesh
+        color: str
+            The color of the mesh
+        vertices: Optional[np.ndarray]
+            The vertices of the mesh with shape (n, 3)
+        faces: Optional[np.ndarray]
+            The faces of the mesh with shape (m, 3)
+
+        Returns
+        -------
+        A list of plotly objects showing the first pose, and for each of
+        them a list of T frame updates, which can be shown in Vis.show_animation.
+        The list of updates is empty if the mesh doesn't move.
+        """
+        if path is not None:
+            vertices, faces = load_mesh(path, scale)
+        else:
+            vertices = vertices * scale
+
+        mesh_plotly = Vis.mesh(
+            trans=trans[0],
+            rot=rot[0],
+            opacity=opacity,
+            color=color,
+            vertices=vertices,
+            faces=faces,
+        )
+        if np.allclose(trans, trans[0]) and np.allclose(rot, rot[0]):
+            return mesh_plotly, []
+
+        v = (np.einsum("tij,kj->tki", rot, vertices) + trans[:, None]).astype(np.float32)
+        return mesh_plotly, [
+            [dict(type="mesh3d", x=vt[:, 0], y=vt[:, 1], z=vt[:, 2]) for vt in v]
+        ]
+
+    @staticmethod
+    def pose_trajectory(
+        trans: np.ndarray,  # (T, 3)
+        rot: np.ndarray,  # (T, 3, 3)
+        width: int = 7,
+        length: float = 0.2,
+    ) -> Tuple[list, List[List[dict]]]:
+        """
+        Visualize a trajectory of T poses with red, green, blue lines
+
+        Parameters
+        ----------
+        trans: np.ndarray
+            The translation part of the poses with shape (T, 3)
+        rot: np.ndarray
+            The rotation part of the poses with shape (T, 3, 3)
+        width: int
+            The width of the lines
+        length: float
+            The length of the lines
+
+        Returns
+        -------
+        A list of plotly objects showing the first pose, and for each of
+        them a list of T frame updates, which can be shown in Vis.show_animation
+        """
+        result, updates = Vis.pose(trans[0], rot[0], width=width, length=length), []
+        for i in range(3):
+            pc = np.stack([trans, trans + rot[:, :, i] * length], axis=1)
+            updates.append(
+                [dict(type="scatter3d", x=p[:, 0], y=p[:, 1], z=p[:, 2]) for p in pc]
+            )
+        return result, updates
+
+    @staticmethod
+    def show_animation(
+        plotly_list: list,
+        updates: List[List[dict]],
+        path: Optional[str] = None,
+        duration: int = 100,
+    ) -> None:
+        """
+        Show the plotly objects as an animation or save it to a html file
+
+        Parameters
+        ----------
+        plotly_list: list
+            A list of plotly objects showing the first frame
+        updates: List[List[dict]]
+            For each of the first len(updates) plotly objects, the list of
+            its updates in each frame, the remaining objects stay static
+        path: Optional[str]
+            The path to save the html file, if None, show in the browser
+        duration: int
+            The duration of each frame in milliseconds
+        """
+        num_frames = len(updates[0]) if len(updates) else 0
+        frames = [
+            go.Frame(
+                data=[u[t] for u in updates],
+                traces=list(range(len(updates))),
+                name=str(t),
+            )
+            for t in range(num_frames)
+        ]
+        play_args = dict(frame=dict(duration=duration, redraw=True), fromcurrent=True)
+        fig = go.Figure(
+            data=plotly_list,
+            frames=frames,
+            layout=go.Layout(
+                scene=dict(aspectmode="data"),
+                updatemenus=[
+                    dict(
+                        type="buttons",
+                        buttons=[
+                            dict(label="Play", method="animate", args=[None, play_args]),
+                            dict(
+                                label="Pause",
+                                method="animate",
+                                args=[[None], dict(mode="immediate")],
+                            ),
+                        ],
+                    )
+                ],
+                sliders=[
+                    dict(
+                        steps=[
+                            dict(
+                                label=f.name,
+                                method="animate",
+                                args=[[f.name], dict(mode="immediate")],
+                            )
+                            for f in frames
+                        ]
+                    )
+                ],
+            ),
+        )
+        if path is None:
+            fig.show()
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fig.write_html(path)
+            print(f"saved in {path}")
+
     @staticmethod
     def show(
         plotly_list: list,
@@ -0,0 +1,35 @@
+import os
+import argparse
+import numpy as np
+
+from src.robot.cfg import get_robot_cfg
+from src.robot.robot_model import RobotModel
+from src.robot.reachability import ReachabilityMap
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the reachability map of the end-effector")
+    parser.add_argument("--robot", type=str, default="galbot")
+    parser.add_argument("--num_samples", type=int, default=2000000)
+    parser.add_argument("--voxel_size", type=float, default=0.03)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--output", type=str, default=None, help="default to data/reachability/<robot>.npz"
+    )
+    args = parser.parse_args()
+
+    np.random.seed(args.seed)
+    robot_model = RobotModel(get_robot_cfg(args.robot))
+    reach_map = ReachabilityMap(voxel_size=args.voxel_size)
+    reach_map.build(robot_model, args.num_samples)
+    reach_map.save(
+        args.output or os.path.join("data", "reachability", f"{args.robot}.npz")
+    )
+    print(
+        f"{reach_map.reachable.any(axis=-1).sum()} reachable voxels, "
+        f"{reach_map.reachable.mean():.3f} of the (voxel, direction) cells are reachable"
+    )
+
+
+if __name__ == "__main__":
+    main()
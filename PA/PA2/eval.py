@@ -10,9 +10,11 @@ from src.type import Grasp
 from src.model import get_model
 from src.config import Config
 from src.path import get_exp_config_from_checkpoint
-from src.sim.grasp_env import Obs, GraspEnvConfig, GraspEnv, get_grasps
+from src.sim.grasp_env import Obs, GraspEnvConfig, GraspEnv, GraspTask, get_grasps
+from src.sim.vec_env import VecGraspEnv
 from src.data import PoseDataset
-from src.utils import transform_grasp_pose
+from src.utils import transform_grasp_pose, to_pose
+from src.constants import OBJ_INIT_TRANS
 from src.vis import Vis
 
 
@@ -29,8 +31,32 @@ def main():
     parser.add_argument("--headless", type=int, default=0)
     parser.add_argument("--wait_steps", type=int, default=15)
     parser.add_argument("--try_plan_num", type=int, default=3)
+    parser.add_argument(
+        "--plan_workers",
+        type=int,
+        default=0,
+        help="Processes planning the grasps of each sample, 0 plans in the main process",
+    )
+    parser.add_argument("--num_envs", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--reachability",
+        type=str,
+        default=None,
+        help="Reachability map from build_reachability.py to skip unreachable grasps before IK, off by default",
+    )
     parser.add_argument("--vis", type=int, default=1)
+    parser.add_argument(
+        "--ik_cache",
+        type=str,
+        default=None,
+        help="IK cache file, loaded at start if it exists and saved at exit (needs --num_envs 1)",
+    )
     args = parser.parse_args()
+    if args.ik_cache is not None and args.num_envs > 1:
+        parser.error("--ik_cache can only be used with --num_envs 1")
+    if args.reachability is not None and not os.path.exists(args.reachability):
+        parser.error(f"{args.reachability} does not exist")
 
     # load config & dataset
     config = Config.from_yaml(get_exp_config_from_checkpoint(args.checkpoint))
@@ -50,73 +76,90 @@ def main():
     model.load_state_dict(checkpoint["model"])
     model = model.eval().to(args.device)
 
-    result = []
-    for dic in tqdm(dataloader):
-        dic = {k: v[0].numpy() for k, v in dic.items()}
-        robot_frame_pc = (
-            np.einsum("ab,nb->na", dic["camera_pose"][:3, :3], dic["pc"])
-            + dic["camera_pose"][:3, 3]
-        )
-        object_pose = dic["obj_pose_in_world"]
+    def get_tasks():
+        for i, dic in enumerate(dataloader):
+            dic = {k: v[0].numpy() for k, v in dic.items()}
+            robot_frame_pc = (
+                np.einsum("ab,nb->na", dic["camera_pose"][:3, :3], dic["pc"])
+                + dic["camera_pose"][:3, 3]
+            )
 
-        env_config = GraspEnvConfig(
-            robot=args.robot,
-            obj_name=args.obj,
-            headless=args.headless,
-            ctrl_dt=args.ctrl_dt,
-            wait_steps=args.wait_steps,
-            obj_pose=object_pose,
-        )
+            with torch.no_grad():
+                est_trans, est_rot = model.est(
+                    torch.from_numpy(dic["pc"])[None].to(args.device)
+                )
+                est_trans, est_rot = est_trans[0].cpu().numpy(), est_rot[0].cpu().numpy()
 
-        with torch.no_grad():
-            est_trans, est_rot = model.est(
-                torch.from_numpy(dic["pc"])[None].to(args.device)
-            )
-            est_trans, est_rot = est_trans[0].cpu().numpy(), est_rot[0].cpu().numpy()
+            if args.vis:
+                Vis.show(
+                    Vis.pc(dic["pc"])
+                    + Vis.mesh(
+                        os.path.join("asset", "obj", args.obj, "single.obj"),
+                        trans=est_trans,
+                        rot=est_rot,
+                        opacity=0.8,
+                    )
+                )
 
-        if args.vis:
-            Vis.show(
-                Vis.pc(dic["pc"])
-                + Vis.mesh(
-                    os.path.join("asset", "obj", args.obj, "single.obj"),
-                    trans=est_trans,
-                    rot=est_rot,
-                    opacity=0.8,
+            robot_frame_grasps = [
+                transform_grasp_pose(
+                    obj_frame_grasp,
+                    est_trans,
+                    est_rot,
+                    dic["camera_pose"][:3, 3],
+                    dic["camera_pose"][:3, :3],
                 )
+                for obj_frame_grasp in get_grasps(args.obj)
+            ]
+            yield GraspTask(
+                obj_pose=dic["obj_pose_in_world"],
+                grasps=robot_frame_grasps,
+                pc=robot_frame_pc,
+                seed=args.seed + i,
             )
 
+    # the simulation is compiled once and reset to each sample's object pose
+    env_config = GraspEnvConfig(
+        robot=args.robot,
+        obj_name=args.obj,
+        headless=args.headless,
+        ctrl_dt=args.ctrl_dt,
+        wait_steps=args.wait_steps,
+        obj_pose=to_pose(OBJ_INIT_TRANS),
+        reachability_path=args.reachability,
+        ik_cache_path=args.ik_cache,
+    )
+    if args.num_envs > 1:
+        env = VecGraspEnv(env_config, args.num_envs)
+        results = env.run(get_tasks(), try_plan_num=args.try_plan_num)
+    else:
         env = GraspEnv(env_config)
         env.launch()
-        env.reset()
-        grasps = get_grasps(args.obj)
-        for obj_frame_grasp in grasps:
-            robot_frame_grasp = transform_grasp_pose(
-                obj_frame_grasp,
-                est_trans,
-                est_rot,
-                dic["camera_pose"][:3, 3],
-                dic["camera_pose"][:3, :3],
-            )
-            for _ in range(args.try_plan_num):
-                plan = env.plan_grasp(robot_frame_grasp, robot_frame_pc)
-                if plan is not None:
-                    break
-            if plan is not None:
-                break
-
-        if plan is not None:
-            succ = env.execute_plan(plan)
-            print(f"Execution {'succeeded' if succ else 'failed'}")
-        else:
-            succ = False
-            print("No plan found")
-        result.append(succ)
-        print(
-            f"Current success rate: {sum(result)}/{len(result)} = {sum(result) / len(result)}"
+        results = (
+            env.run_task(task, i, args.try_plan_num, args.plan_workers)
+            for i, task in enumerate(get_tasks())
         )
 
-        env.close()
+    # the workers and the simulation are shut down even if a task fails
+    try:
+        result = []
+        for res in tqdm(results, total=len(dataloader)):
+            if res.plan_found:
+                print(
+                    f"Sample {res.index}: execution {'succeeded' if res.succ else 'failed'}"
+                    f" (plan {res.plan_time:.2f}s, sim {res.exec_time:.2f}s)"
+                )
+            else:
+                print(f"Sample {res.index}: no plan found (plan {res.plan_time:.2f}s)")
+            result.append(res.succ)
+            print(
+                f"Current success rate: {sum(result)}/{len(result)} = {sum(result) / len(result)}"
+            )
 
+        if args.ik_cache is not None:
+            print(f"IK cache: {env.robot_model.ik_cache.stats()}")
+    finally:
+        env.close()
 
 if __name__ == "__main__":
     main()
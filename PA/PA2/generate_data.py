@@ -0,0 +1,43 @@
+import os
+import argparse
+from tqdm import tqdm
+
+from src.sim.grasp_env import GraspEnvConfig
+from src.sim.datagen import DataGenerator
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate the pose estimation dataset")
+    parser.add_argument("--robot", type=str, default="galbot")
+    parser.add_argument("--obj", type=str, default="power_drill")
+    parser.add_argument("--mode", type=str, default="train")
+    parser.add_argument("--ctrl_dt", type=float, default=0.1)
+    parser.add_argument("--wait_steps", type=int, default=25)
+    parser.add_argument("--num_samples", type=int, default=100000)
+    parser.add_argument("--shard_size", type=int, default=1000)
+    parser.add_argument("--num_workers", type=int, default=os.cpu_count())
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    env_config = GraspEnvConfig(
+        robot=args.robot,
+        obj_name=args.obj,
+        headless=True,
+        ctrl_dt=args.ctrl_dt,
+        wait_steps=args.wait_steps,
+    )
+    generator = DataGenerator(
+        env_config,
+        os.path.join("data", args.obj, args.mode),
+        args.num_samples,
+        shard_size=args.shard_size,
+        seed=args.seed,
+    )
+    # rerunning the same command resumes from the missing shards
+    with tqdm(total=args.num_samples, initial=generator.num_done()) as pbar:
+        for num in generator.run(args.num_workers):
+            pbar.update(num)
+
+
+if __name__ == "__main__":
+    main()
@@ -34,6 +34,7 @@ def main():
             env.close()
             continue
 
+        scene = env.get_scene(obs.robot_frame_pc)
         grasps = get_grasps(args.obj)
         for obj_frame_grasp in grasps:
             robot_frame_grasp = Grasp(
@@ -42,7 +43,7 @@ def main():
                 rot=obs.object_pose[:3, :3] @ obj_frame_grasp.rot,
                 width=obj_frame_grasp.width,
             )
-            plan = env.plan_grasp(robot_frame_grasp, obs.robot_frame_pc)
+            plan = env.plan_grasp(robot_frame_grasp, scene)
             if plan is not None:
                 break
 
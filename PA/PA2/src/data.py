@@ -8,6 +8,7 @@ from torch.utils.data import Dataset, DataLoader
 from .config import Config
 from .constants import DEPTH_IMG_SCALE, TABLE_HEIGHT, PC_MAX, PC_MIN, OBJ_INIT_TRANS
 from .utils import get_pc, get_workspace_mask
+from .shard import ShardReader, is_shard
 from .vis import Vis
 from .robot.cfg import get_robot_cfg
 
@@ -31,7 +32,20 @@ class PoseDataset(Dataset):
         self.config = config
         self.robot_cfg = get_robot_cfg(config.robot)
         self.data_root = os.path.join("data", config.obj_name, mode)
-        self.files = sorted(os.listdir(self.data_root))
+        # one item per sample directory saved by GraspEnv.save_obs,
+        # and one per sample of the shards written by generate_data.py
+        self.shards: Dict[str, ShardReader] = dict()
+        self.files = []
+        for f in sorted(os.listdir(self.data_root)):
+            fdir = os.path.join(self.data_root, f)
+            if f.endswith(".tmp"):
+                # left over by an interrupted generate_data.py run
+                continue
+            if is_shard(fdir):
+                self.shards[f] = ShardReader(fdir)
+                self.files += [(f, i) for i in range(len(self.shards[f]))]
+            elif os.path.exists(os.path.join(fdir, "object_pose.npy")):
+                self.files.append((f, None))
         self.files = self.files * scale
         random.shuffle(self.files)
 
@@ -77,22 +91,27 @@ class PoseDataset(Dataset):
         """
         try:
 
-            f = self.files[idx] if idx is not None else random.choice(self.files)
+            f, i = self.files[idx] if idx is not None else random.choice(self.files)
             fdir = os.path.join(self.data_root, f)
 
-            obj_pose = np.load(os.path.join(fdir, "object_pose.npy"))
+            if i is not None:
+                sample = self.shards[f][i]
+                obj_pose, camera_pose = sample["object_pose"], sample["camera_pose"]
+                depth_array = sample["depth"]
+            else:
+                obj_pose = np.load(os.path.join(fdir, "object_pose.npy"))
+                camera_pose = np.load(os.path.join(fdir, "camera_pose.npy"))
+                depth_array = (
+                    np.array(
+                        cv2.imread(os.path.join(fdir, "depth.png"), cv2.IMREAD_UNCHANGED)
+                    )
+                    / DEPTH_IMG_SCALE
+                )
             if not np.linalg.norm(obj_pose[:2, 3] - OBJ_INIT_TRANS[:2]) < 0.1:
                 # some times the object will be out of the workspace
                 # so we need to skip this sample
                 # this rarely happens so we don't need to worry about it
                 return self.__getitem__()
-            camera_pose = np.load(os.path.join(fdir, "camera_pose.npy"))
-            depth_array = (
-                np.array(
-                    cv2.imread(os.path.join(fdir, "depth.png"), cv2.IMREAD_UNCHANGED)
-                )
-                / DEPTH_IMG_SCALE
-            )
 
             full_pc_camera = get_pc(
                 depth_array, self.robot_cfg.camera_cfg.intrinsics
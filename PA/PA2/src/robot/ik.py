@@ -0,0 +1,275 @@
+from typing import Optional, Tuple
+import numpy as np
+
+from src.robot.kinematics import KinematicTree
+
+
+def rot_log(rot: np.ndarray) -> np.ndarray:
+    """
+    Convert rotation matrices into rotation vectors.
+
+    Parameters
+    ----------
+    rot : np.ndarray
+        Rotation matrices with shape (..., 3, 3).
+
+    Returns
+    -------
+    np.ndarray
+        Rotation vectors (axis * angle) with shape (..., 3).
+    """
+    w = 0.5 * np.stack(
+        [
+            rot[..., 2, 1] - rot[..., 1, 2],
+            rot[..., 0, 2] - rot[..., 2, 0],
+            rot[..., 1, 0] - rot[..., 0, 1],
+        ],
+        axis=-1,
+    )
+    sin = np.linalg.norm(w, axis=-1)
+    cos = (np.trace(rot, axis1=-2, axis2=-1) - 1) / 2
+    angle = np.arctan2(sin, cos)
+    scale = np.where(sin > 1e-8, angle / np.maximum(sin, 1e-8), 1.0)
+    return w * scale[..., None]
+
+
+def converged(err: np.ndarray, trans_tol: float, rot_tol: float) -> np.ndarray:
+    """Whether the pose errors (..., 6) are within the tolerances."""
+    return (np.linalg.norm(err[..., :3], axis=-1) < trans_tol) & (
+        np.linalg.norm(err[..., 3:], axis=-1) < rot_tol
+    )
+
+
+class IKSolver:
+    def __init__(
+        self,
+        kinematics: KinematicTree,
+        link_name: str,
+        lower: Optional[np.ndarray] = None,
+        upper: Optional[np.ndarray] = None,
+    ):
+        """
+        Batched Levenberg-Marquardt inverse kinematics for one link.
+
+        All problems, i.e. every target times every seed, are iterated in
+        lockstep with one forward kinematics and Jacobian pass per iteration.
+        A target stops iterating as soon as one of its seeds converges.
+
+        Parameters
+        ----------
+        kinematics : KinematicTree
+            The kinematic tree of the robot.
+        link_name : str
+            The link whose pose is solved for.
+        lower, upper : Optional[np.ndarray]
+            (J,) joint limits, default to the limits in the URDF.
+        """
+        self.kinematics = kinematics
+        self.link_name = link_name
+        lower = kinematics.joint_lower if lower is None else lower
+        upper = kinematics.joint_upper if upper is None else upper
+        # only the joints that move the link are solved for
+        anchor = kinematics.link_anchors[kinematics.link_index[link_name]]
+        self.joint_indices = np.flatnonzero(kinematics.frame_ancestors[anchor])
+        self.lower = np.asarray(lower, dtype=float)[self.joint_indices]
+        self.upper = np.asarray(upper, dtype=float)[self.joint_indices]
+
+    def error(
+        self, qpos: np.ndarray, target: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Compute the pose error and the Jacobian of the link.
+
+        Parameters
+        ----------
+        qpos : np.ndarray
+            (B, K) positions of the solved joints.
+        target : np.ndarray
+            (B, 4, 4) target poses.
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            The error (B, 6) with translation first, rotation vector second,
+            and the Jacobian (B, 6, K).
+        """
+        full = np.zeros((len(qpos), len(self.kinematics.joint_names)))
+        full[:, self.joint_indices] = qpos
+        pose, jac = self.kinematics.jacobian(full, self.link_name)
+        err = np.concatenate(
+            [
+                target[:, :3, 3] - pose[:, :3, 3],
+                rot_log(target[:, :3, :3] @ pose[:, :3, :3].transpose(0, 2, 1)),
+            ],
+            axis=-1,
+        )
+        return err, jac[..., self.joint_indices]
+
+    def solve(
+        self,
+        target: np.ndarray,
+        init_qpos: Optional[np.ndarray] = None,
+        num_seeds: int = 10,
+        max_iters: int = 100,
+        trans_tol: float = 1e-3,
+        rot_tol: float = 1e-2,
+        delta_thresh: Optional[float] = None,
+        damping: float = 1e-2,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Solve the inverse kinematics of many targets with many seeds.
+
+        Parameters
+        ----------
+        target : np.ndarray
+            (B, 4, 4) target poses of the link.
+        init_qpos : Optional[np.ndarray]
+            (B, K) or (K,) initial positions of the solved joints. They are
+            used as the first seed, and the converged solution closest to
+            them is returned. Without it, the one with the lowest error is returned.
+        num_seeds : int
+            Number of seeds per target, the others are uniformly sampled
+            within the joint limits.
+        max_iters : int
+            Maximum number of iterations.
+        trans_tol, rot_tol : float
+            Tolerances of the translation and rotation error.
+        delta_thresh : Optional[float]
+            If set, solutions further than this from init_qpos are rejected.
+        damping : float
+            Initial damping of the Levenberg-Marquardt steps.
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            (B,) whether each target is solved and (B, K) the solutions.
+        """
+        target = np.asarray(target, dtype=float)
+        batch_size, num_joints = len(target), len(self.joint_indices)
+        qpos = np.random.uniform(
+            self.lower, self.upper, (batch_size, num_seeds, num_joints)
+        )
+        if init_qpos is not None:
+            init_qpos = np.broadcast_to(init_qpos, (batch_size, num_joints))
+            qpos[:, 0] = np.clip(init_qpos, self.lower, self.upper)
+        qpos = qpos.reshape(-1, num_joints)
+        target = np.repeat(target, num_seeds, axis=0)
+        if init_qpos is not None:
+            seed_init = np.repeat(init_qpos, num_seeds, axis=0)
+
+        def is_solved(qpos, err):
+            solved = converged(err, trans_tol, rot_tol)
+            if init_qpos is not None and delta_thresh is not None:
+                solved &= np.linalg.norm(qpos - seed_init, axis=-1) <= delta_thresh
+            return solved
+
+        lam = np.full(len(qpos), damping)
+        err, jac = self.error(qpos, target)
+        cost = np.sum(err**2, axis=-1)
+        eye = np.eye(6)
+        for _ in range(max_iters):
+            # stop iterating the seeds that converged and all seeds of solved targets
+            solved = is_solved(qpos, err)
+            target_solved = solved.reshape(batch_size, num_seeds).any(axis=-1)
+            active = np.flatnonzero(
+                ~solved & ~np.repeat(target_solved, num_seeds)
+            )
+            if len(active) == 0:
+                break
+            a_jac, a_err, a_lam = jac[active], err[active], lam[active]
+            # damped least squares step dq = J^T (J J^T + lambda I)^-1 e
+            jjt = a_jac @ a_jac.transpose(0, 2, 1) + a_lam[:, None, None] * eye
+            step = (a_jac.transpose(0, 2, 1) @ np.linalg.solve(jjt, a_err[..., None]))[..., 0]
+            new_qpos = np.clip(qpos[active] + step, self.lower, self.upper)
+            new_err, new_jac = self.error(new_qpos, target[active])
+            new_cost = np.sum(new_err**2, axis=-1)
+            accept = new_cost < cost[active]
+            rows = active[accept]
+            qpos[rows], err[rows], jac[rows] = new_qpos[accept], new_err[accept], new_jac[accept]
+            cost[rows] = new_cost[accept]
+            lam[active] = np.clip(np.where(accept, a_lam / 2, a_lam * 4), 1e-6, 1e3)
+
+        succ = is_solved(qpos, err).reshape(batch_size, num_seeds)
+        qpos = qpos.reshape(batch_size, num_seeds, num_joints)
+        cost = cost.reshape(batch_size, num_seeds)
+        score = cost
+        if init_qpos is not None:
+            score = np.linalg.norm(qpos - init_qpos[:, None], axis=-1)
+        # the best successful seed, or the one with the lowest error if none succeeded
+        best = np.where(
+            succ.any(axis=-1),
+            np.argmin(np.where(succ, score, np.inf), axis=-1),
+            np.argmin(cost, axis=-1),
+        )
+        rows = np.arange(batch_size)
+        return succ[rows, best], qpos[rows, best]
+
+    def solve_path(
+        self,
+        target: np.ndarray,
+        init_qpos: np.ndarray,
+        max_iters: int = 10,
+        trans_tol: float = 1e-3,
+        rot_tol: float = 1e-2,
+        delta_thresh: Optional[float] = None,
+        damping: float = 1e-4,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Follow Cartesian paths, warm-starting every waypoint from the previous one.
+
+        Each waypoint only takes a few damped pseudo-inverse steps, which is
+        enough when the waypoints are close to each other.
+
+        Parameters
+        ----------
+        target : np.ndarray
+            (B, T, 4, 4) target poses of the link along B paths.
+        init_qpos : np.ndarray
+            (B, K) or (K,) positions of the solved joints before the first waypoint.
+        max_iters : int
+            Maximum number of steps per waypoint.
+        trans_tol, rot_tol : float
+            Tolerances of the translation and rotation error.
+        delta_thresh : Optional[float]
+            If set, a waypoint is infeasible when its solution is further than
+            this from the previous one.
+        damping : float
+            Damping of the pseudo-inverse.
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            (B,) the index of the first infeasible waypoint of each path, -1 if
+            the whole path is feasible, and (B, T, K) the solutions. Waypoints
+            from the first infeasible one on are not meaningful.
+        """
+        target = np.asarray(target, dtype=float)
+        batch_size, num_steps = target.shape[:2]
+        qpos = np.array(
+            np.broadcast_to(init_qpos, (batch_size, len(self.joint_indices))),
+            dtype=float,
+        )
+        path = np.zeros((batch_size, num_steps, len(self.joint_indices)))
+        first_fail = np.full(batch_size, -1)
+        eye = np.eye(6)
+        for t in range(num_steps):
+            prev = qpos.copy()
+            active = np.flatnonzero(first_fail < 0)
+            for _ in range(max_iters):
+                err, jac = self.error(qpos[active], target[active, t])
+                done = converged(err, trans_tol, rot_tol)
+                if done.all():
+                    break
+                active, err, jac = active[~done], err[~done], jac[~done]
+                jjt = jac @ jac.transpose(0, 2, 1) + damping * eye
+                step = (jac.transpose(0, 2, 1) @ np.linalg.solve(jjt, err[..., None]))[..., 0]
+                qpos[active] = np.clip(qpos[active] + step, self.lower, self.upper)
+            else:
+                err, _ = self.error(qpos[active], target[active, t])
+                done = converged(err, trans_tol, rot_tol)
+                first_fail[active[~done]] = t
+            if delta_thresh is not None:
+                jump = np.linalg.norm(qpos - prev, axis=-1) > delta_thresh
+                first_fail[jump & (first_fail < 0)] = t
+            path[:, t] = qpos
+        return first_fail, path
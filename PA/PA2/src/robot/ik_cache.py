@@ -0,0 +1,146 @@
+import os
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+import numpy as np
+from transforms3d.quaternions import mat2quat
+
+
+class IKCache:
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        trans_res: float = 0.005,
+        rot_res: float = 0.05,
+        capacity: int = 100000,
+    ):
+        """
+        LRU cache of verified IK solutions keyed by the target pose on an SE(3) grid.
+
+        Parameters
+        ----------
+        path : Optional[str]
+            .npz file backing the cache on disk. It is loaded if it exists and
+            written by save().
+        trans_res : float
+            Grid resolution of the translation in meters.
+        rot_res : float
+            Grid resolution of the unit quaternion components, about half of
+            the rotation angle resolution in radians.
+        capacity : int
+            Maximum number of entries, the least recently used ones are evicted.
+        """
+        self.path = path
+        self.trans_res = trans_res
+        self.rot_res = rot_res
+        self.capacity = capacity
+        self.entries: "OrderedDict[Tuple[int, ...], np.ndarray]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.solve_time = dict(hit=0.0, miss=0.0)
+        if path is not None and os.path.exists(path):
+            self.load()
+
+    def key(self, trans: np.ndarray, rot: np.ndarray) -> Tuple[int, ...]:
+        """The grid cell of a target pose."""
+        quat = mat2quat(rot)
+        # q and -q are the same rotation, make the largest component positive
+        # (the sign of w is ambiguous for rotations of about pi)
+        quat = quat * np.sign(quat[np.argmax(np.abs(quat))])
+        return tuple(
+            np.concatenate(
+                [
+                    np.round(np.asarray(trans) / self.trans_res),
+                    np.round(quat / self.rot_res),
+                ]
+            )
+            .astype(int)
+            .tolist()
+        )
+
+    def get(self, trans: np.ndarray, rot: np.ndarray) -> Optional[np.ndarray]:
+        """Return the cached solution of the cell of the target pose, or None."""
+        key = self.key(trans, rot)
+        qpos = self.entries.get(key)
+        if qpos is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return qpos.copy()
+
+    def put(self, trans: np.ndarray, rot: np.ndarray, qpos: np.ndarray):
+        """Store a verified solution of the target pose."""
+        key = self.key(trans, rot)
+        self.entries[key] = np.array(qpos, dtype=float)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def subset(self, keys) -> "IKCache":
+        """An in-memory cache with the same resolution holding the entries of the given keys, e.g. to send to a worker process."""
+        ret = IKCache(None, self.trans_res, self.rot_res, self.capacity)
+        for key in keys:
+            if key in self.entries:
+                ret.entries[key] = self.entries[key]
+        return ret
+
+    def merge(self, other: "IKCache"):
+        """Add the entries and the statistics of a cache returned by a worker process."""
+        for key, qpos in other.entries.items():
+            self.entries[key] = qpos
+            self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+        self.hits += other.hits
+        self.misses += other.misses
+        for k in self.solve_time:
+            self.solve_time[k] += other.solve_time[k]
+
+    def record_solve(self, hit: bool, elapsed: float):
+        """Accumulate the time spent solving, split by cache hits and misses."""
+        self.solve_time["hit" if hit else "miss"] += elapsed
+
+    def stats(self) -> Dict[str, float]:
+        """Hit rate and solve-time statistics."""
+        lookups = self.hits + self.misses
+        return dict(
+            entries=len(self.entries),
+            hits=self.hits,
+            misses=self.misses,
+            hit_rate=self.hits / lookups if lookups else 0.0,
+            mean_hit_time=self.solve_time["hit"] / self.hits if self.hits else 0.0,
+            mean_miss_time=(
+                self.solve_time["miss"] / self.misses if self.misses else 0.0
+            ),
+        )
+
+    def save(self, path: Optional[str] = None):
+        """Write the cache to disk, in least to most recently used order."""
+        path = self.path if path is None else path
+        if path is None:
+            raise ValueError("The cache has no path, pass one to save()")
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        keys = np.array(list(self.entries.keys()), dtype=int).reshape(-1, 7)
+        values = np.array(list(self.entries.values()), dtype=float)
+        # write to a temporary file first so that an interrupted save keeps the old cache
+        tmp_path = path + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            keys=keys,
+            values=values,
+            res=np.array([self.trans_res, self.rot_res]),
+        )
+        os.replace(tmp_path, path)
+
+    def load(self, path: Optional[str] = None):
+        """Load the cache from disk. Files saved with another grid resolution are ignored."""
+        path = self.path if path is None else path
+        if path is None:
+            raise ValueError("The cache has no path, pass one to load()")
+        data = np.load(path)
+        if not np.allclose(data["res"], [self.trans_res, self.rot_res]):
+            return
+        for key, qpos in zip(data["keys"], data["values"]):
+            self.entries[tuple(key.tolist())] = qpos
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
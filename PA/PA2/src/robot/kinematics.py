@@ -0,0 +1,238 @@
+import xml.etree.ElementTree as ET
+from typing import Dict, List, Tuple
+import numpy as np
+from transforms3d.euler import euler2mat
+
+from src.utils import to_pose
+
+
+MOVABLE_JOINT_TYPES = ("revolute", "continuous", "prismatic")
+
+
+class KinematicTree:
+    def __init__(self, path_urdf: str, joint_names: List[str]):
+        """
+        Batched forward kinematics of the kinematic tree in a URDF.
+
+        Fixed joints are collapsed into constant offsets, so each forward
+        kinematics pass costs one matrix product per movable joint, and
+        movable joints at the same depth of the tree are computed together.
+
+        Parameters
+        ----------
+        path_urdf : str
+            Path to the URDF file.
+        joint_names : List[str]
+            The movable joints in qpos order. Movable joints of the URDF
+            that are not in this list are kept at zero.
+        """
+        self.joint_names = list(joint_names)
+        root = ET.parse(path_urdf).getroot()
+        link_names = [l.attrib["name"] for l in root.findall("link")]
+
+        joints, children = dict(), {name: [] for name in link_names}
+        for child in root.findall("joint"):
+            origin = child.find("origin")
+            origin = dict() if origin is None else origin.attrib
+            axis = child.find("axis")
+            limit = child.find("limit")
+            limit = dict() if limit is None or child.attrib["type"] == "continuous" else limit.attrib
+            joint = dict(
+                name=child.attrib["name"],
+                type=child.attrib["type"],
+                parent=child.find("parent").attrib["link"],
+                child=child.find("child").attrib["link"],
+                origin=to_pose(
+                    trans=np.array(origin.get("xyz", "0 0 0").split(), dtype=float),
+                    rot=euler2mat(*np.array(origin.get("rpy", "0 0 0").split(), dtype=float)),
+                ),
+                axis=np.array(
+                    ("1 0 0" if axis is None else axis.attrib["xyz"]).split(), dtype=float
+                ),
+                lower=float(limit.get("lower", -np.pi)),
+                upper=float(limit.get("upper", np.pi)),
+            )
+            joints[joint["name"]] = joint
+            children[joint["parent"]].append(joint)
+
+        # sort the links so that every parent comes before its children
+        child_links = {j["child"] for j in joints.values()}
+        roots = [name for name in link_names if name not in child_links]
+        assert len(roots) == 1, f"Expected a single root link, got {roots}"
+        self.link_names, sorted_joints = roots, []
+        for name in self.link_names:
+            for joint in children[name]:
+                sorted_joints.append(joint)
+                self.link_names.append(joint["child"])
+        self.link_index = {name: i for i, name in enumerate(self.link_names)}
+
+        for name in self.joint_names:
+            if name not in joints or joints[name]["type"] not in MOVABLE_JOINT_TYPES:
+                raise ValueError(f"{name} is not a movable joint in {path_urdf}")
+        self._compile(sorted_joints)
+
+    def _compile(self, sorted_joints: List[dict]):
+        """
+        Precompute the constant parts of the tree.
+
+        - joint_axes: (J, 3) unit axes of the movable joints
+        - joint_is_prismatic: (J,) whether the joint translates along its axis
+        - joint_lower, joint_upper: (J,) joint limits, [-pi, pi] for continuous joints
+        - joint_skew, joint_skew_sq: (J, 3, 3) skew matrix K of the axes and K @ K
+        - joint_parents: (J,) the frame joint j is attached to,
+          0 for the root link and k + 1 for joint k
+        - joint_levels: lists of joints with the same depth, in increasing depth
+        - joint_offsets: (J, 4, 4) constant transform from the parent frame
+          to the origin of joint j
+        - frame_ancestors: (J + 1, J) whether joint j moves frame f
+        - link_anchors: (L,) the frame each link hangs off
+        - link_offsets: (L, 4, 4) constant transform from the anchor frame to the link
+        """
+        num_links, num_joints = len(self.link_names), len(self.joint_names)
+        joint_index = {name: j for j, name in enumerate(self.joint_names)}
+
+        self.joint_axes = np.zeros((num_joints, 3))
+        self.joint_is_prismatic = np.zeros(num_joints, dtype=bool)
+        self.joint_lower = np.zeros(num_joints)
+        self.joint_upper = np.zeros(num_joints)
+        self.joint_parents = np.zeros(num_joints, dtype=int)
+        self.joint_offsets = np.zeros((num_joints, 4, 4))
+        self.frame_ancestors = np.zeros((num_joints + 1, num_joints), dtype=bool)
+        self.link_anchors = np.zeros(num_links, dtype=int)
+        self.link_offsets = np.tile(np.eye(4), (num_links, 1, 1))
+        frame_depth = np.zeros(num_joints + 1, dtype=int)
+
+        for joint in sorted_joints:
+            parent = self.link_index[joint["parent"]]
+            child = self.link_index[joint["child"]]
+            anchor = self.link_anchors[parent]
+            offset = self.link_offsets[parent] @ joint["origin"]
+            if joint["name"] in joint_index:
+                j = joint_index[joint["name"]]
+                self.joint_axes[j] = joint["axis"] / np.linalg.norm(joint["axis"])
+                self.joint_is_prismatic[j] = joint["type"] == "prismatic"
+                self.joint_lower[j], self.joint_upper[j] = joint["lower"], joint["upper"]
+                self.joint_parents[j] = anchor
+                self.joint_offsets[j] = offset
+                self.frame_ancestors[j + 1] = self.frame_ancestors[anchor]
+                self.frame_ancestors[j + 1, j] = True
+                frame_depth[j + 1] = frame_depth[anchor] + 1
+                self.link_anchors[child] = j + 1
+            else:
+                self.link_anchors[child] = anchor
+                self.link_offsets[child] = offset
+
+        x, y, z = self.joint_axes.T
+        zero = np.zeros_like(x)
+        self.joint_skew = np.stack(
+            [
+                np.stack([zero, -z, y], axis=-1),
+                np.stack([z, zero, -x], axis=-1),
+                np.stack([-y, x, zero], axis=-1),
+            ],
+            axis=-2,
+        )
+        self.joint_skew_sq = self.joint_skew @ self.joint_skew
+        joint_depth = frame_depth[1:]
+        self.joint_levels = [
+            np.flatnonzero(joint_depth == d)
+            for d in range(1, joint_depth.max(initial=0) + 1)
+        ]
+
+    def fk(self, qpos: np.ndarray) -> np.ndarray:
+        """
+        Compute the poses of all links.
+
+        Parameters
+        ----------
+        qpos : np.ndarray
+            Joint positions with shape (J,) or (B, J).
+
+        Returns
+        -------
+        np.ndarray
+            The link poses with shape (L, 4, 4) or (B, L, 4, 4), ordered as link_names.
+        """
+        qpos = np.asarray(qpos, dtype=float)
+        _, poses = self.fk_frames(qpos.reshape(-1, qpos.shape[-1]))
+        return poses.reshape(qpos.shape[:-1] + poses.shape[1:])
+
+    def fk_frames(self, qpos: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Compute the joint frames and the link poses.
+
+        Parameters
+        ----------
+        qpos : np.ndarray
+            Joint positions with shape (B, J).
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            The frames (B, J + 1, 4, 4), where frames[:, 0] is the root link
+            and frames[:, j + 1] is joint j after applying qpos[:, j],
+            and the link poses (B, L, 4, 4).
+        """
+        frames = self.joint_frames(qpos)
+        poses = frames[:, self.link_anchors] @ self.link_offsets
+        return frames, poses
+
+    def joint_frames(self, qpos: np.ndarray) -> np.ndarray:
+        """
+        Compute the joint frames (B, J + 1, 4, 4) of qpos (B, J), see fk_frames.
+        """
+        batch_size, num_joints = qpos.shape
+        assert num_joints == len(self.joint_names), f"Expected {len(self.joint_names)} joints, got {num_joints}"
+
+        # Rodrigues' formula for all joints at once, prismatic joints don't rotate
+        angle = np.where(self.joint_is_prismatic, 0.0, qpos)[..., None, None]
+        motion = np.zeros((batch_size, num_joints, 4, 4))
+        motion[..., :3, :3] = (
+            np.eye(3)
+            + np.sin(angle) * self.joint_skew
+            + (1 - np.cos(angle)) * self.joint_skew_sq
+        )
+        motion[..., :3, 3] = (
+            np.where(self.joint_is_prismatic, qpos, 0.0)[..., None] * self.joint_axes
+        )
+        motion[..., 3, 3] = 1.0
+        local = self.joint_offsets @ motion
+
+        frames = np.empty((batch_size, num_joints + 1, 4, 4))
+        frames[:, 0] = np.eye(4)
+        for level in self.joint_levels:
+            frames[:, level + 1] = frames[:, self.joint_parents[level]] @ local[:, level]
+        return frames
+
+    def jacobian(self, qpos: np.ndarray, link_name: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Compute the pose and the geometric Jacobian of a link.
+
+        Parameters
+        ----------
+        qpos : np.ndarray
+            Joint positions with shape (B, J).
+        link_name : str
+            The link to compute the Jacobian for.
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            The link pose (B, 4, 4) and the Jacobian (B, 6, J) in the root
+            frame, whose first three rows are the linear velocity and last
+            three rows the angular velocity. Columns of joints that don't move
+            the link are zero.
+        """
+        link = self.link_index[link_name]
+        frames = self.joint_frames(qpos)
+        pose = frames[:, self.link_anchors[link]] @ self.link_offsets[link]
+        # the joint rotates about / slides along its axis expressed in its own frame
+        axes = np.einsum("bjxy,jy->bjx", frames[:, 1:, :3, :3], self.joint_axes)
+        arms = pose[:, None, :3, 3] - frames[:, 1:, :3, 3]
+        linear = np.where(
+            self.joint_is_prismatic[:, None], axes, np.cross(axes, arms)
+        )
+        angular = np.where(self.joint_is_prismatic[:, None], 0.0, axes)
+        mask = self.frame_ancestors[self.link_anchors[link]][:, None]
+        jac = np.concatenate([linear * mask, angular * mask], axis=-1)
+        return pose, jac.transpose(0, 2, 1)
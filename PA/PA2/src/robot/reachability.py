@@ -0,0 +1,179 @@
+import os
+from typing import Optional
+import numpy as np
+from scipy.ndimage import binary_dilation
+
+from src.constants import PC_MIN, PC_MAX
+
+
+class ReachabilityMap:
+    def __init__(
+        self,
+        lower: Optional[np.ndarray] = None,
+        upper: Optional[np.ndarray] = None,
+        voxel_size: float = 0.03,
+        num_azimuth: int = 16,
+        num_elevation: int = 8,
+    ):
+        """
+        Which end-effector poses are reachable, indexed by position voxel and
+        approach direction bin.
+
+        The approach direction is the x axis of the end-effector, binned by
+        azimuth and by the cosine of the polar angle so that all bins cover
+        the same solid angle. The rotation about the approach axis is ignored.
+
+        Parameters
+        ----------
+        lower, upper : Optional[np.ndarray]
+            (3,) corners of the mapped box, default to the workspace box
+            PC_MIN/PC_MAX padded by 0.3 m.
+        voxel_size : float
+            Edge length of a position voxel in meters.
+        num_azimuth, num_elevation : int
+            Number of direction bins along the azimuth and the polar angle.
+        """
+        self.lower = np.array(PC_MIN - 0.3 if lower is None else lower, dtype=float)
+        self.upper = np.array(PC_MAX + 0.3 if upper is None else upper, dtype=float)
+        self.voxel_size = voxel_size
+        self.num_azimuth = num_azimuth
+        self.num_elevation = num_elevation
+        self.grid_shape = tuple(
+            np.ceil((self.upper - self.lower) / voxel_size).astype(int).tolist()
+        )
+        self.reachable = np.zeros(
+            self.grid_shape + (num_azimuth * num_elevation,), dtype=bool
+        )
+
+    def index(self, trans: np.ndarray, rot: np.ndarray):
+        """
+        Compute the voxel and direction bin of poses.
+
+        Parameters
+        ----------
+        trans : np.ndarray
+            (..., 3) end-effector translations.
+        rot : np.ndarray
+            (..., 3, 3) end-effector rotations.
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            (..., 3) voxel indices and (...,) direction bins. Voxel indices
+            outside of the box are out of range.
+        """
+        voxel = np.floor((trans - self.lower) / self.voxel_size).astype(int)
+        approach = rot[..., :, 0]
+        azimuth = np.arctan2(approach[..., 1], approach[..., 0])
+        az_bin = ((azimuth + np.pi) / (2 * np.pi) * self.num_azimuth).astype(int)
+        el_bin = ((np.clip(approach[..., 2], -1, 1) + 1) / 2 * self.num_elevation).astype(int)
+        az_bin = np.clip(az_bin, 0, self.num_azimuth - 1)
+        el_bin = np.clip(el_bin, 0, self.num_elevation - 1)
+        return voxel, el_bin * self.num_azimuth + az_bin
+
+    def build(
+        self,
+        robot_model,
+        num_samples: int = 1000000,
+        batch_size: int = 10000,
+        dilate: bool = True,
+    ):
+        """
+        Mark the poses reached by uniformly sampled joint positions.
+
+        Parameters
+        ----------
+        robot_model : RobotModel
+            The robot whose end-effector is mapped.
+        num_samples : int
+            Number of joint positions to sample.
+        batch_size : int
+            Number of joint positions per forward kinematics pass.
+        dilate : bool
+            Also mark the neighbours of reached cells, in position and in
+            direction (the azimuth wraps around), so that sparse sampling
+            rejects fewer reachable poses.
+        """
+        kinematics = robot_model.kinematics
+        eef = robot_model.link_index[robot_model.cfg.link_eef]
+        for start in range(0, num_samples, batch_size):
+            size = min(batch_size, num_samples - start)
+            # kinematics.fk takes qpos in cfg.joint_names order
+            qpos = np.random.uniform(
+                kinematics.joint_lower,
+                kinematics.joint_upper,
+                (size, len(kinematics.joint_names)),
+            )
+            pose = kinematics.fk(qpos)[:, eef]
+            voxel, direction = self.index(pose[:, :3, 3], pose[:, :3, :3])
+            inside = np.all((voxel >= 0) & (voxel < self.grid_shape), axis=-1)
+            voxel, direction = voxel[inside], direction[inside]
+            self.reachable[voxel[:, 0], voxel[:, 1], voxel[:, 2], direction] = True
+        if dilate:
+            self.dilate()
+
+    def dilate(self):
+        """Mark the cells next to reached ones in position, elevation and azimuth."""
+        reachable = self.reachable.reshape(
+            self.grid_shape + (self.num_elevation, self.num_azimuth)
+        )
+        # pad the azimuth with the bins of the other side, it is periodic
+        reachable = np.concatenate(
+            [reachable[..., -1:], reachable, reachable[..., :1]], axis=-1
+        )
+        reachable = binary_dilation(reachable, structure=np.ones((3,) * 5, dtype=bool))
+        self.reachable = reachable[..., 1:-1].reshape(self.reachable.shape)
+
+    def is_reachable(self, trans: np.ndarray, rot: np.ndarray) -> np.ndarray:
+        """
+        Whether poses may be reachable. Poses outside of the box are assumed reachable.
+
+        Parameters
+        ----------
+        trans : np.ndarray
+            (..., 3) end-effector translations.
+        rot : np.ndarray
+            (..., 3, 3) end-effector rotations.
+
+        Returns
+        -------
+        np.ndarray
+            (...,) False if the pose was never reached when building the map.
+        """
+        voxel, direction = self.index(np.asarray(trans), np.asarray(rot))
+        inside = np.all((voxel >= 0) & (voxel < self.grid_shape), axis=-1)
+        voxel = np.where(inside[..., None], voxel, 0)
+        reached = self.reachable[voxel[..., 0], voxel[..., 1], voxel[..., 2], direction]
+        return reached | ~inside
+
+    def save(self, path: str):
+        """Save the map with the reachable flags packed into bits."""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        np.savez_compressed(
+            path,
+            lower=self.lower,
+            upper=self.upper,
+            voxel_size=self.voxel_size,
+            num_bins=np.array([self.num_azimuth, self.num_elevation]),
+            reachable=np.packbits(self.reachable),
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "ReachabilityMap":
+        """Load a map saved by save()."""
+        data = np.load(path)
+        num_azimuth, num_elevation = data["num_bins"].tolist()
+        ret = cls(
+            data["lower"],
+            data["upper"],
+            float(data["voxel_size"]),
+            num_azimuth,
+            num_elevation,
+        )
+        size = int(np.prod(ret.reachable.shape))
+        ret.reachable = (
+            np.unpackbits(data["reachable"], count=size)
+            .astype(bool)
+            .reshape(ret.reachable.shape)
+        )
+        return ret
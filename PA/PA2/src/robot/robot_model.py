@@ -1,13 +1,19 @@
 import os
+import time
 import yaml
-from typing import Optional, List, Dict, Tuple
+from typing import Optional, List, Dict, Tuple, Union
 from transforms3d.euler import euler2mat
 import numpy as np
 import xml.etree.ElementTree as ET
 import roboticstoolbox as rtb
+from scipy.spatial import cKDTree
 
 from src.robot.cfg import RobotCfg
-from src.utils import to_pose, rot_dist
+from src.robot.kinematics import KinematicTree
+from src.robot.ik import IKSolver
+from src.robot.ik_cache import IKCache
+from src.robot.scene import SceneGrid
+from src.utils import to_pose
 from src.vis import Vis
 
 
@@ -23,12 +29,29 @@ class RobotModel:
         """
         self.cfg = robot_cfg
         self.robot = rtb.ERobot.URDF(os.path.abspath(robot_cfg.path_urdf))
-        joints = [l for l in self.robot.links if l.isjoint]
-        self.joint_lower_limit = np.array([j.qlim[0] for j in joints])
-        self.joint_upper_limit = np.array([j.qlim[1] for j in joints])
+        self.kinematics = KinematicTree(robot_cfg.path_urdf, robot_cfg.joint_names)
+        self.link_names = self.kinematics.link_names
+        self.link_index = self.kinematics.link_index
+        # qpos always follows cfg.joint_names, also for the limits
+        self.joint_lower_limit = self.kinematics.joint_lower
+        self.joint_upper_limit = self.kinematics.joint_upper
+        self.ik_solver = IKSolver(self.kinematics, robot_cfg.link_eef)
+        self.ik_cache: Optional[IKCache] = None
+        # the last point cloud passed to get_pc_tree and its KD-tree
+        self._pc_tree_points: Optional[np.ndarray] = None
+        self._pc_tree: Optional[cKDTree] = None
         self.setup_visual()
         self.setup_collision()
 
+    def enable_ik_cache(self, path: Optional[str] = None, **kwargs) -> IKCache:
+        """
+        Cache the IK solutions of cold solves, see IKCache for the arguments.
+
+        Call ik_cache.save() to persist it and ik_cache.stats() for the hit rate.
+        """
+        self.ik_cache = IKCache(path, **kwargs)
+        return self.ik_cache
+
     def setup_visual(self):
         """Load the visual mesh information"""
         self.link_meshes = dict()
@@ -84,6 +107,52 @@ class RobotModel:
             radii = np.array([s["radius"] for s in spheres])
             self.collision_spheres[link_name] = dict(center=centers, radius=radii)
 
+        # pack all spheres into flat arrays so that they can be transformed at once
+        self.collision_link_names = list(self.collision_spheres.keys())
+        sphere_link = np.concatenate(
+            [
+                np.full(len(s["radius"]), i)
+                for i, s in enumerate(self.collision_spheres.values())
+            ]
+        ).astype(int)
+        self.sphere_centers = np.concatenate(
+            [s["center"].reshape(-1, 3) for s in self.collision_spheres.values()]
+        )
+        self.sphere_radii = np.concatenate(
+            [s["radius"] for s in self.collision_spheres.values()]
+        )
+        self.sphere_link_onehot = (
+            sphere_link[:, None] == np.arange(len(self.collision_link_names))
+        )
+        self.sphere_pose_index = np.array(
+            [self.link_index[self.collision_link_names[i]] for i in sphere_link], dtype=int
+        )
+        # (K, K) links pairs excluded from self collision, compiled from collision_ignore
+        num_links = len(self.collision_link_names)
+        link_id = {name: i for i, name in enumerate(self.collision_link_names)}
+        self.link_pair_ignore = np.eye(num_links, dtype=bool)
+        for link_a, links in self.cfg.collision_ignore.items():
+            for link_b in links:
+                if link_a in link_id and link_b in link_id:
+                    self.link_pair_ignore[link_id[link_a], link_id[link_b]] = True
+                    self.link_pair_ignore[link_id[link_b], link_id[link_a]] = True
+
+        # (P,) sphere pairs checked for self collision, sorted by their link pair,
+        # and the (U,) link pairs they belong to with the start of each in the sorted list
+        pair_a, pair_b = np.nonzero(
+            np.triu(~self.link_pair_ignore[sphere_link[:, None], sphere_link[None]])
+        )
+        pair_link = sphere_link[pair_a] * num_links + sphere_link[pair_b]
+        order = np.argsort(pair_link, kind="stable")
+        self.self_pair_a, self.self_pair_b = pair_a[order], pair_b[order]
+        self.self_pair_radius = (
+            self.sphere_radii[self.self_pair_a] + self.sphere_radii[self.self_pair_b]
+        )
+        link_pairs, self.self_pair_starts = np.unique(
+            pair_link[order], return_index=True
+        )
+        self.self_link_pairs = np.stack(np.divmod(link_pairs, num_links), axis=-1)
+
     def fk_link(
         self, qpos: np.ndarray, link_name: str
     ) -> Tuple[np.ndarray, np.ndarray]:
@@ -102,8 +171,8 @@ class RobotModel:
         Tuple[np.ndarray, np.ndarray]
             The translation (3,) and rotation matrix (3, 3) of the specified link.
         """
-        fk = self.robot.fkine(qpos, end=link_name)
-        return fk.A[:3, 3], fk.A[:3, :3]
+        pose = self.fk_all_link_pose(qpos)[self.link_index[link_name]]
+        return pose[:3, 3], pose[:3, :3]
 
     def fk_eef(self, qpos: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
         """
@@ -144,6 +213,23 @@ class RobotModel:
         cam_rot = link_rot @ rel_cam_rot
         return cam_trans, cam_rot
 
+    def fk_all_link_pose(self, qpos: np.ndarray) -> np.ndarray:
+        """
+        Compute the forward kinematics of all links in a single pass.
+
+        Parameters
+        ----------
+        qpos : np.ndarray
+            Joint positions of the robot, (J,) or batched (B, J).
+
+        Returns
+        -------
+        np.ndarray
+            The poses of all links with shape (L, 4, 4) or (B, L, 4, 4),
+            use self.link_index to find the index of a link by its name.
+        """
+        return self.kinematics.fk(qpos)
+
     def fk_all_link(self, qpos: np.ndarray) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
         """
         Compute the forward kinematics of all links in the robot.
@@ -158,11 +244,11 @@ class RobotModel:
         Dict[str, Tuple[np.ndarray, np.ndarray]]
             A dictionary mapping link names to their translation (3,) and rotation matrix (3, 3).
         """
-        ret = dict()
-        for link in self.robot.links:
-            fk = self.robot.fkine(qpos, end=link.name)
-            ret[link.name] = fk.A[:3, 3], fk.A[:3, :3]
-        return ret
+        poses = self.fk_all_link_pose(qpos)
+        return {
+            name: (poses[i, :3, 3], poses[i, :3, :3])
+            for name, i in self.link_index.items()
+        }
 
     def uniform_rand_qpos(self) -> np.ndarray:
         """
@@ -171,7 +257,7 @@ class RobotModel:
         Returns
         -------
         np.ndarray
-            A randomly sampled joint position vector.
+            A randomly sampled joint position vector in cfg.joint_names order.
         """
         qpos = np.random.uniform(self.joint_lower_limit, self.joint_upper_limit)
         return qpos
@@ -198,7 +284,7 @@ class RobotModel:
         init_qpos : Optional[np.ndarray], optional (J,)
             Initial joint positions for the solver (default is None).
         retry_times : int, optional
-            Number of retries for the solver (default is 10).
+            Number of seeds solved at once (default is 10).
         trans_tol : float, optional
             Tolerance for translation (default is 1e-3).
         rot_tol : float, optional
@@ -217,19 +303,121 @@ class RobotModel:
         -----
         This function only return the joint angles that affect the end-effector.
         """
-        pose = to_pose(trans, rot)
-        for _ in range(retry_times):
-            ik_result, success, _, _, _ = self.robot.ik_lm_chan(
-                pose, end=self.cfg.link_eef, q0=init_qpos
-            )
-            if success:
-                if delta_thresh is not None:
-                    if np.linalg.norm(ik_result - init_qpos) > delta_thresh:
-                        continue
-                t, r = self.fk_link(ik_result, self.cfg.link_eef)
-                if np.linalg.norm(t - trans) < trans_tol and rot_dist(r, rot) < rot_tol:
-                    return True, ik_result
-        return False, ik_result
+        # cold solves are seeded with the cached solution of the same grid cell
+        cache = self.ik_cache if init_qpos is None else None
+        start = time.time()
+        if cache is not None:
+            init_qpos = cache.get(trans, rot)
+        succ, qpos = self.ik_batch(
+            trans[None],
+            rot[None],
+            None if init_qpos is None else np.asarray(init_qpos)[None],
+            num_seeds=retry_times,
+            trans_tol=trans_tol,
+            rot_tol=rot_tol,
+            delta_thresh=delta_thresh,
+        )
+        if cache is not None:
+            cache.record_solve(init_qpos is not None, time.time() - start)
+            if succ[0]:
+                cache.put(trans, rot, qpos[0])
+        return bool(succ[0]), qpos[0]
+
+    def ik_batch(
+        self,
+        trans: np.ndarray,
+        rot: np.ndarray,
+        init_qpos: Optional[np.ndarray] = None,
+        num_seeds: int = 10,
+        trans_tol=1e-3,
+        rot_tol=1e-2,
+        delta_thresh: float = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Batched inverse kinematics of the end-effector for many targets.
+
+        Every target is solved from num_seeds seeds at once, see IKSolver.
+
+        Parameters
+        ----------
+        trans : np.ndarray (B, 3)
+            The desired translations of the end-effector.
+        rot : np.ndarray (B, 3, 3)
+            The desired rotations of the end-effector.
+        init_qpos : Optional[np.ndarray], optional (B, K) or (K,)
+            Initial joint positions for the solver (default is None).
+        num_seeds : int, optional
+            Number of seeds per target (default is 10).
+        trans_tol : float, optional
+            Tolerance for translation (default is 1e-3).
+        rot_tol : float, optional
+            Tolerance for rotation (default is 1e-2).
+        delta_thresh : float, optional
+            Threshold for joint position change when init_qpos is provided.
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            (B,) whether each target is solved and (B, K) the joint positions
+            of the K joints that affect the end-effector.
+        """
+        target = np.tile(np.eye(4), (len(trans), 1, 1))
+        target[:, :3, :3], target[:, :3, 3] = rot, trans
+        return self.ik_solver.solve(
+            target,
+            init_qpos,
+            num_seeds=num_seeds,
+            trans_tol=trans_tol,
+            rot_tol=rot_tol,
+            delta_thresh=delta_thresh,
+        )
+
+    def ik_path(
+        self,
+        trans: np.ndarray,
+        rot: np.ndarray,
+        init_qpos: np.ndarray,
+        trans_tol=1e-3,
+        rot_tol=1e-2,
+        delta_thresh: float = None,
+    ) -> Tuple[int, np.ndarray]:
+        """
+        Inverse kinematics along a Cartesian path of the end-effector.
+
+        Every waypoint is warm-started from the solution of the previous one
+        and refined with a few Jacobian pseudo-inverse steps.
+
+        Parameters
+        ----------
+        trans : np.ndarray (T, 3)
+            The desired translations of the end-effector.
+        rot : np.ndarray (T, 3, 3)
+            The desired rotations of the end-effector.
+        init_qpos : np.ndarray (K,)
+            Joint positions before the first waypoint.
+        trans_tol : float, optional
+            Tolerance for translation (default is 1e-3).
+        rot_tol : float, optional
+            Tolerance for rotation (default is 1e-2).
+        delta_thresh : float, optional
+            Threshold for joint position change between consecutive waypoints.
+
+        Returns
+        -------
+        Tuple[int, np.ndarray]
+            The index of the first infeasible waypoint, -1 if all are feasible,
+            and the (T, K) joint positions of the joints that affect the end-effector.
+        """
+        target = np.tile(np.eye(4), (len(trans), 1, 1))
+        target[:, :3, :3], target[:, :3, 3] = rot, trans
+        first_fail, path = self.ik_solver.solve_path(
+            target[None],
+            init_qpos,
+            trans_tol=trans_tol,
+            rot_tol=rot_tol,
+            delta_thresh=delta_thresh,
+        )
+        return int(first_fail[0]), path[0]
 
     def vis(
         self,
@@ -282,8 +470,101 @@ class RobotModel:
                     )
         return lst
 
+    def collision_sphere_centers(self, qpos: np.ndarray) -> np.ndarray:
+        """
+        Compute the centers of all collision spheres in the robot frame.
+
+        Parameters
+        ----------
+        qpos : np.ndarray (..., J)
+            Joint positions of the robot, optionally batched.
+
+        Returns
+        -------
+        np.ndarray (..., S, 3)
+            The sphere centers, in the order of sphere_radii.
+        """
+        poses = self.fk_all_link_pose(qpos)[..., self.sphere_pose_index, :, :]
+        return (
+            np.einsum("...ab,...b->...a", poses[..., :3, :3], self.sphere_centers)
+            + poses[..., :3, 3]
+        )
+
+    def get_pc_tree(self, pc: Union[np.ndarray, cKDTree]) -> cKDTree:
+        """
+        Build a KD-tree of the point cloud for collision queries.
+
+        The tree of the last point cloud is cached by the identity of the
+        array, so repeated checks against the same observation only build it
+        once. Changes to the array in place are not noticed, pass a new array
+        (or the tree itself) after modifying it.
+        """
+        if isinstance(pc, cKDTree):
+            return pc
+        if pc is not self._pc_tree_points:
+            self._pc_tree_points, self._pc_tree = pc, cKDTree(np.asarray(pc, dtype=float))
+        return self._pc_tree
+
+    def collision_report(
+        self,
+        qpos: np.ndarray,
+        pc: Union[np.ndarray, cKDTree, SceneGrid],
+        thresh: float = 0.0025,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Check the collision of every link with the point cloud and with each other.
+
+        Parameters
+        ----------
+        qpos : np.ndarray (..., J)
+            Joint positions of the robot, optionally batched.
+        pc : np.ndarray (N, 3), cKDTree or SceneGrid
+            Point cloud data to check for collisions. Pass a cKDTree or a
+            SceneGrid built from the point cloud to reuse it across many calls,
+            all of them give the same result.
+        thresh : float, optional
+            Collision threshold (default is 0.0025).
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            (..., K) whether each link in collision_link_names collides with
+            the point cloud, and (..., K, K) whether link i collides with link j
+            (only i < j is filled).
+        """
+        centers = self.collision_sphere_centers(qpos)
+        onehot = self.sphere_link_onehot.astype(float)
+
+        if isinstance(pc, SceneGrid):
+            # the field is a lower bound, the spheres it doesn't clear are checked exactly
+            dist = pc.distance(centers)
+            near = dist - self.sphere_radii < thresh
+            dist[near] = pc.exact_distance(centers[near])
+        else:
+            dist, _ = self.get_pc_tree(pc).query(centers)
+        sphere_collide = dist - self.sphere_radii < thresh
+        link_collide = sphere_collide.astype(float) @ onehot > 0
+
+        num_links = len(self.collision_link_names)
+        link_pair_collide = np.zeros(
+            centers.shape[:-2] + (num_links, num_links), dtype=bool
+        )
+        if len(self.self_pair_a):
+            dist = np.linalg.norm(
+                centers[..., self.self_pair_a, :] - centers[..., self.self_pair_b, :],
+                axis=-1,
+            )
+            pair_collide = dist - self.self_pair_radius < thresh
+            link_pair_collide[
+                ..., self.self_link_pairs[:, 0], self.self_link_pairs[:, 1]
+            ] = np.logical_or.reduceat(pair_collide, self.self_pair_starts, axis=-1)
+        return link_collide, link_pair_collide
+
     def check_collision(
-        self, qpos: np.ndarray, pc: np.ndarray, thresh: float = 0.0025
+        self,
+        qpos: np.ndarray,
+        pc: Union[np.ndarray, cKDTree, SceneGrid],
+        thresh: float = 0.0025,
     ) -> Tuple[bool, str]:
         """
         Check if the point cloud collides with the robot's collision spheres or between two links.
@@ -292,7 +573,7 @@ class RobotModel:
         ----------
         qpos : np.ndarray (J,)
             Joint positions of the robot.
-        pc : np.ndarray (N, 3)
+        pc : np.ndarray (N, 3), cKDTree or SceneGrid
             Point cloud data to check for collisions.
         thresh : float, optional
             Collision threshold (default is 0.0025).
@@ -302,35 +583,62 @@ class RobotModel:
         Tuple[bool, str]
             A tuple indicating if a collision occurred and the cause of the collision.
         """
-        fk_links = self.fk_all_link(qpos)
-        link_spheres = dict()
-        for link, spheres in self.collision_spheres.items():
-            trans, rot = fk_links[link]
-            center = np.einsum("ab,nb->na", rot, spheres["center"]) + trans
-            link_spheres[link] = dict(center=center, radius=spheres["radius"])
-
-        for link, spheres in link_spheres.items():
-            for center, radius in zip(spheres["center"], spheres["radius"]):
-                dist = np.linalg.norm(pc[:, None] - center[None], axis=-1) - radius
-                if np.any(dist < thresh):
-                    return True, link
-
-        link_list = list(link_spheres.keys())
-        for i in range(len(link_list)):
-            for j in range(i + 1, len(link_list)):
-                link_a, link_b = link_list[i], link_list[j]
-                if self.cfg.is_collision_ignore(link_a, link_b):
-                    continue
-                for center_a, radius_a in zip(
-                    link_spheres[link_a]["center"], link_spheres[link_a]["radius"]
-                ):
-                    for center_b, radius_b in zip(
-                        link_spheres[link_b]["center"], link_spheres[link_b]["radius"]
-                    ):
-                        dist = np.linalg.norm(center_a - center_b) - (
-                            radius_a + radius_b
-                        )
-                        if dist < thresh:
-                            return True, f"{link_a} and {link_b}"
-
-        return False, ""
+        link_collide, link_pair_collide = self.collision_report(qpos, pc, thresh)
+        cause = self._collision_cause(link_collide, link_pair_collide)
+        return cause is not None, "" if cause is None else cause
+
+    def check_trajectory_collision(
+        self,
+        traj: np.ndarray,
+        pc: Union[np.ndarray, cKDTree, SceneGrid],
+        thresh: float = 0.0025,
+        num_interp: int = 0,
+    ) -> Tuple[int, str]:
+        """
+        Check a whole trajectory for collisions in one batched pass.
+
+        Parameters
+        ----------
+        traj : np.ndarray (T, J)
+            Joint positions of the waypoints.
+        pc : np.ndarray (N, 3), cKDTree or SceneGrid
+            Point cloud data to check for collisions.
+        thresh : float, optional
+            Collision threshold (default is 0.0025).
+        num_interp : int, optional
+            Number of configurations linearly interpolated in joint space
+            between every two waypoints (default is 0, only the waypoints).
+
+        Returns
+        -------
+        Tuple[int, str]
+            The index of the first colliding waypoint, or -1 if the trajectory
+            is collision free, and the cause of the collision. A collision in
+            between waypoints t - 1 and t is reported as t.
+        """
+        traj = np.asarray(traj, dtype=float)
+        if num_interp > 0 and len(traj) > 1:
+            ratio = np.arange(1, num_interp + 2) / (num_interp + 1)
+            segment = traj[:-1, None] + ratio[:, None] * (traj[1:] - traj[:-1])[:, None]
+            qpos = np.concatenate([traj[:1], segment.reshape(-1, traj.shape[-1])])
+        else:
+            qpos = traj
+        link_collide, link_pair_collide = self.collision_report(qpos, pc, thresh)
+        collide = link_collide.any(axis=-1) | link_pair_collide.any(axis=(-2, -1))
+        if not collide.any():
+            return -1, ""
+        k = np.argmax(collide)
+        cause = self._collision_cause(link_collide[k], link_pair_collide[k])
+        return int(np.ceil(k / (num_interp + 1))), cause
+
+    def _collision_cause(
+        self, link_collide: np.ndarray, link_pair_collide: np.ndarray
+    ) -> Optional[str]:
+        """Describe the first collision of a single configuration, or None if there is none."""
+        if link_collide.any():
+            return self.collision_link_names[np.argmax(link_collide)]
+        if link_pair_collide.any():
+            i, j = np.argwhere(link_pair_collide)[0]
+            link_a, link_b = self.collision_link_names[i], self.collision_link_names[j]
+            return f"{link_a} and {link_b}"
+        return None
@@ -0,0 +1,166 @@
+from typing import Optional
+import numpy as np
+from scipy.ndimage import distance_transform_edt
+from scipy.spatial import cKDTree
+
+from src.constants import PC_MIN, PC_MAX
+
+
+class SceneGrid:
+    def __init__(
+        self,
+        voxel_size: float = 0.0025,
+        trunc_dist: float = 0.1,
+        lower: Optional[np.ndarray] = None,
+        upper: Optional[np.ndarray] = None,
+        points_per_voxel: int = 4,
+    ):
+        """
+        Voxel occupancy grid of the scene with a truncated distance field.
+
+        The field stores, for every voxel, the distance to the nearest
+        occupied voxel, truncated at trunc_dist. It is built once per
+        observation and used as the broad phase of collision queries: one
+        lookup per sphere gives a lower bound of its clearance, and only the
+        spheres the bound can't clear are checked exactly against the points
+        with exact_distance.
+
+        Parameters
+        ----------
+        voxel_size : float
+            Edge length of a voxel in meters.
+        trunc_dist : float
+            Distances larger than this are stored as trunc_dist. It should be
+            larger than the biggest collision sphere radius plus the threshold.
+        lower, upper : Optional[np.ndarray]
+            (3,) corners of the grid, default to PC_MIN and PC_MAX.
+        points_per_voxel : int
+            At most this many points of every voxel are kept for
+            exact_distance, all of them from the frame that first occupied
+            the voxel. Further frames of the same scene then neither grow the
+            points nor rebuild the KD-tree. A dropped point shares its voxel
+            with a kept one, so exact_distance is off by less than a voxel
+            diagonal near the voxels where points were dropped.
+        """
+        self.voxel_size = voxel_size
+        self.trunc_dist = trunc_dist
+        self.lower = np.array(PC_MIN if lower is None else lower, dtype=float)
+        self.upper = np.array(PC_MAX if upper is None else upper, dtype=float)
+        self.shape = tuple(
+            np.ceil((self.upper - self.lower) / voxel_size).astype(int).tolist()
+        )
+        self.occupancy = np.zeros(self.shape, dtype=bool)
+        self.field = np.full(self.shape, trunc_dist)
+        self.points_per_voxel = points_per_voxel
+        self.points = np.zeros((0, 3))
+        self._tree: Optional[cKDTree] = None
+        # a query point and an occupied point can both be half a voxel diagonal
+        # away from their voxel centers
+        self._margin = voxel_size * np.sqrt(3)
+
+    @classmethod
+    def from_points(cls, pc: np.ndarray, **kwargs) -> "SceneGrid":
+        """Build the grid from a point cloud (N, 3) in the robot frame."""
+        grid = cls(**kwargs)
+        grid.integrate(pc)
+        return grid
+
+    def clear(self):
+        """Remove all occupied voxels."""
+        self.occupancy[:] = False
+        self.field[:] = self.trunc_dist
+        self.points, self._tree = np.zeros((0, 3)), None
+
+    def integrate(self, pc: np.ndarray):
+        """
+        Add the points of a new frame to the grid.
+
+        Points outside of the grid are ignored. Only the points of newly
+        occupied voxels are kept for exact_distance, at most
+        points_per_voxel of each. Adding points can
+        only shrink the distance field, so it is only recomputed in the box
+        around the newly occupied voxels that is within trunc_dist of them.
+
+        Parameters
+        ----------
+        pc : np.ndarray
+            (N, 3) point cloud in the robot frame.
+        """
+        pc = np.asarray(pc, dtype=float)
+        idx = np.floor((pc - self.lower) / self.voxel_size).astype(int)
+        inside = np.all((idx >= 0) & (idx < self.shape), axis=-1)
+        idx, pc = idx[inside], pc[inside]
+
+        # the first points_per_voxel points of every voxel that wasn't occupied yet
+        voxel = np.ravel_multi_index(tuple(idx.T), self.shape)
+        order = np.argsort(voxel, kind="stable")
+        voxel = voxel[order]
+        rank = np.arange(len(voxel)) - np.searchsorted(voxel, voxel)
+        keep = (rank < self.points_per_voxel) & ~self.occupancy.reshape(-1)[voxel]
+        if keep.any():
+            self.points = np.concatenate([self.points, pc[order[keep]]])
+            self._tree = None
+
+        new = np.zeros(self.shape, dtype=bool)
+        new[tuple(idx.T)] = True
+        new &= ~self.occupancy
+        if not new.any():
+            return
+        self.occupancy |= new
+
+        reach = int(np.ceil(self.trunc_dist / self.voxel_size))
+        new_idx = np.argwhere(new)
+        start = np.maximum(new_idx.min(axis=0) - reach, 0)
+        stop = np.minimum(new_idx.max(axis=0) + reach + 1, self.shape)
+        box = tuple(slice(a, b) for a, b in zip(start, stop))
+        dist = distance_transform_edt(~new[box], sampling=self.voxel_size)
+        self.field[box] = np.minimum(self.field[box], dist)
+
+    def distance(self, points: np.ndarray) -> np.ndarray:
+        """
+        Lower bound of the distance from each point to the scene.
+
+        Points outside of the grid use the distance to the grid box combined
+        with the field at the closest voxel, which is still a lower bound since
+        all occupied voxels are inside the box.
+
+        Parameters
+        ----------
+        points : np.ndarray
+            (..., 3) query points in the robot frame.
+
+        Returns
+        -------
+        np.ndarray
+            (...,) distances, at most trunc_dist and negative inside occupied voxels.
+        """
+        points = np.asarray(points, dtype=float)
+        clamped = np.clip(points, self.lower, self.upper)
+        outside = np.linalg.norm(points - clamped, axis=-1)
+        idx = np.floor((clamped - self.lower) / self.voxel_size).astype(int)
+        idx = np.clip(idx, 0, np.array(self.shape) - 1)
+        inside = self.field[idx[..., 0], idx[..., 1], idx[..., 2]] - self._margin
+        dist = np.where(
+            outside > 0, np.sqrt(outside**2 + np.maximum(inside, 0) ** 2), inside
+        )
+        return np.minimum(dist, self.trunc_dist)
+
+    def exact_distance(self, points: np.ndarray) -> np.ndarray:
+        """
+        Exact distance from each point (..., 3) to the nearest kept point,
+        inf if the grid is empty. The KD-tree is built on the first query after
+        an integrate that kept new points.
+        """
+        points = np.asarray(points, dtype=float)
+        if len(self.points) == 0:
+            return np.full(points.shape[:-1], np.inf)
+        if self._tree is None:
+            self._tree = cKDTree(self.points)
+        dist, _ = self._tree.query(points)
+        return dist
+
+    def __getstate__(self):
+        # the KD-tree is rebuilt on demand instead of being pickled into worker processes
+        state = self.__dict__.copy()
+        state["_tree"] = None
+        return state
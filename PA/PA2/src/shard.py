@@ -0,0 +1,114 @@
+import os
+import shutil
+from typing import Dict, List
+import numpy as np
+import cv2
+
+from .constants import DEPTH_IMG_SCALE
+
+
+# files of a shard, the images are PNG encoded and concatenated into one blob each
+IMAGE_KEYS = ("depth", "obj_seg")
+POSE_KEYS = ("camera_pose", "object_pose")
+
+
+# written last, a shard directory without it is incomplete
+DONE_MARKER = "done"
+
+
+def is_shard(path: str) -> bool:
+    """Whether path is a complete shard written by write_shard."""
+    return not path.endswith(".tmp") and os.path.exists(os.path.join(path, DONE_MARKER))
+
+
+def write_shard(path: str, samples: List[Dict[str, np.ndarray]]):
+    """
+    Write samples into one shard directory.
+
+    The images are encoded the same way as GraspEnv.save_obs, so a shard
+    sample decodes to exactly what the per-sample directories contain, but a
+    shard of thousands of samples is only a handful of files. The shard is
+    written to a temporary directory, marked as done and renamed at the
+    end, so a shard either exists completely or not at all. A shard that
+    already exists at path is renamed aside before and only deleted after
+    the new one is in place.
+
+    Parameters
+    ----------
+    path : str
+        Directory of the shard.
+    samples : List[Dict[str, np.ndarray]]
+        Each with depth (H, W) in meters, obj_seg (H, W) in uint8,
+        camera_pose (4, 4) and object_pose (4, 4).
+    """
+    tmp_path = path + ".tmp"
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+    for key in IMAGE_KEYS:
+        blobs = []
+        for sample in samples:
+            img = sample[key]
+            if key == "depth":
+                img = (np.clip(img, 0, 2.0) * DEPTH_IMG_SCALE).astype(np.uint16)
+            ok, blob = cv2.imencode(".png", img)
+            assert ok, f"Failed to encode {key}"
+            blobs.append(blob.reshape(-1))
+        offsets = np.cumsum([0] + [len(b) for b in blobs])
+        np.concatenate(blobs).tofile(os.path.join(tmp_path, f"{key}.bin"))
+        np.save(os.path.join(tmp_path, f"{key}_offsets.npy"), offsets)
+    for key in POSE_KEYS:
+        np.save(
+            os.path.join(tmp_path, f"{key}.npy"), np.stack([s[key] for s in samples])
+        )
+    open(os.path.join(tmp_path, DONE_MARKER), "w").close()
+    # also ends with .tmp, so that readers skip it like an unfinished shard
+    old_path = path + ".old.tmp"
+    if os.path.exists(old_path):
+        shutil.rmtree(old_path)
+    if os.path.exists(path):
+        os.replace(path, old_path)
+    os.replace(tmp_path, path)
+    if os.path.exists(old_path):
+        shutil.rmtree(old_path)
+
+
+class ShardReader:
+    def __init__(self, path: str):
+        """
+        Random access to the samples of a shard. The blobs are memory mapped,
+        so reading a sample only touches its own bytes.
+        """
+        self.path = path
+        self.offsets = {
+            key: np.load(os.path.join(path, f"{key}_offsets.npy")) for key in IMAGE_KEYS
+        }
+        self.poses = {
+            key: np.load(os.path.join(path, f"{key}.npy")) for key in POSE_KEYS
+        }
+        self._blobs = None
+
+    def __len__(self) -> int:
+        return len(self.offsets["depth"]) - 1
+
+    def __getitem__(self, idx: int) -> Dict[str, np.ndarray]:
+        """The sample idx with depth (H, W) in meters, obj_seg (H, W), camera_pose and object_pose."""
+        # opened lazily so that readers can be pickled into dataloader workers
+        if self._blobs is None:
+            self._blobs = {
+                key: np.memmap(os.path.join(self.path, f"{key}.bin"), mode="r")
+                for key in IMAGE_KEYS
+            }
+        ret = {key: value[idx] for key, value in self.poses.items()}
+        for key in IMAGE_KEYS:
+            start, stop = self.offsets[key][idx], self.offsets[key][idx + 1]
+            ret[key] = cv2.imdecode(
+                np.asarray(self._blobs[key][start:stop]), cv2.IMREAD_UNCHANGED
+            )
+        ret["depth"] = ret["depth"] / DEPTH_IMG_SCALE
+        return ret
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_blobs"] = None
+        return state
@@ -0,0 +1,150 @@
+import os
+import json
+import multiprocessing as mp
+from dataclasses import replace
+from typing import Iterator, List, Tuple
+
+import numpy as np
+
+from src.shard import is_shard, write_shard
+from src.sim.grasp_env import GraspEnv, GraspEnvConfig
+from src.sim.vec_env import init_worker, worker_env
+
+
+def shard_path(data_root: str, shard: int) -> str:
+    return os.path.join(data_root, f"shard_{shard:05d}")
+
+
+def generate_sample(env: GraspEnv, seed: int, index: int) -> dict:
+    """
+    Generate one sample: restore the launch snapshot, drop the object at a
+    random pose and render depth and segmentation.
+
+    The random state is reseeded from (seed, index), so a sample only depends
+    on its index and not on the worker or the samples generated before it.
+    """
+    np.random.seed([seed, index])
+    env.reset(rand_obj=True)
+    obs = env.get_obs(with_rgb=False)
+    return dict(
+        depth=obs.depth,
+        obj_seg=obs.seg,
+        camera_pose=obs.camera_pose,
+        object_pose=obs.object_pose,
+    )
+
+
+def _generate_shard(args) -> int:
+    data_root, shard, start, stop, seed = args
+    samples = [generate_sample(worker_env(), seed, index) for index in range(start, stop)]
+    write_shard(shard_path(data_root, shard), samples)
+    return stop - start
+
+
+class DataGenerator:
+    def __init__(
+        self,
+        config: GraspEnvConfig,
+        data_root: str,
+        num_samples: int,
+        shard_size: int = 1000,
+        seed: int = 0,
+    ):
+        """
+        Generate a pose estimation dataset as shards of shard_size samples.
+
+        Every worker launches one headless GraspEnv and generates whole shards
+        from its launch snapshot, so the model is compiled once per worker
+        instead of once per sample. Finished shards are kept on disk, so an
+        interrupted run resumes from the shards that are missing, and since
+        every sample is seeded by its index the result doesn't depend on the
+        number of workers or on interruptions.
+
+        Parameters
+        ----------
+        config : GraspEnvConfig
+            Configuration of the environments, headless is forced.
+        data_root : str
+            Output directory, e.g. data/<obj_name>/<mode>.
+        num_samples : int
+            Total number of samples.
+        shard_size : int
+            Number of samples per shard.
+        seed : int
+            Base random seed.
+        """
+        self.config = replace(config, headless=True)
+        self.data_root = data_root
+        self.num_samples = num_samples
+        self.shard_size = shard_size
+        self.seed = seed
+        self.num_shards = -(-num_samples // shard_size)
+        self._check_meta()
+
+    def _check_meta(self):
+        """
+        Record the settings in meta.json, and refuse to resume a run made with
+        other settings. Besides the dataset layout these are all the
+        GraspEnvConfig fields that change the samples, i.e. the simulation
+        run by generate_sample.
+        """
+        meta = dict(
+            robot=self.config.robot,
+            obj_name=self.config.obj_name,
+            ctrl_dt=self.config.ctrl_dt,
+            wait_steps=self.config.wait_steps,
+            num_samples=self.num_samples,
+            shard_size=self.shard_size,
+            seed=self.seed,
+        )
+        path = os.path.join(self.data_root, "meta.json")
+        if os.path.exists(path):
+            with open(path) as f:
+                old_meta = json.load(f)
+            if old_meta != meta:
+                raise ValueError(
+                    f"{self.data_root} was generated with {old_meta}, got {meta}"
+                )
+            return
+        os.makedirs(self.data_root, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(meta, f, indent=2)
+
+    def shard_range(self, shard: int) -> Tuple[int, int]:
+        """The indices [start, stop) of the samples of a shard."""
+        start = shard * self.shard_size
+        return start, min(start + self.shard_size, self.num_samples)
+
+    def pending_shards(self) -> List[int]:
+        """The shards that are not on disk yet."""
+        return [
+            s
+            for s in range(self.num_shards)
+            if not is_shard(shard_path(self.data_root, s))
+        ]
+
+    def num_done(self) -> int:
+        """Number of samples already on disk."""
+        return self.num_samples - sum(
+            stop - start for start, stop in map(self.shard_range, self.pending_shards())
+        )
+
+    def run(self, num_workers: int = 1) -> Iterator[int]:
+        """
+        Generate the pending shards.
+
+        Yields the number of samples of every shard as soon as it is written.
+        """
+        tasks = [
+            (self.data_root, shard, *self.shard_range(shard), self.seed)
+            for shard in self.pending_shards()
+        ]
+        if len(tasks) == 0:
+            return
+        # spawned like the workers of VecGraspEnv
+        with mp.get_context("spawn").Pool(
+            min(num_workers, len(tasks)),
+            initializer=init_worker,
+            initargs=(self.config,),
+        ) as pool:
+            yield from pool.imap_unordered(_generate_shard, tasks)
@@ -1,7 +1,8 @@
 import os
 import time
-from typing import List, Optional, Tuple
-from dataclasses import dataclass
+import multiprocessing as mp
+from typing import List, Optional, Tuple, Union
+from dataclasses import dataclass, replace
 import numpy as np
 from PIL import Image
 
@@ -10,6 +11,9 @@ from src.utils import to_pose, rand_rot_mat, get_pc, get_workspace_mask
 from src.constants import DEPTH_IMG_SCALE, TABLE_HEIGHT
 from src.robot.cfg import get_robot_cfg
 from src.robot.robot_model import RobotModel
+from src.robot.ik_cache import IKCache
+from src.robot.scene import SceneGrid
+from src.robot.reachability import ReachabilityMap
 from src.sim.mujoco import MjSim
 from src.sim.cfg import MjSimConfig, MjRenderConfig
 from src.vis import Vis
@@ -17,8 +21,8 @@ from src.vis import Vis
 
 @dataclass
 class Obs:
-    rgb: np.ndarray
-    """(H, W, 3) in RGB order"""
+    rgb: Optional[np.ndarray]
+    """(H, W, 3) in RGB order, None if not rendered"""
     depth: np.ndarray
     """(H, W) in meters"""
     seg: np.ndarray
@@ -33,6 +37,32 @@ class Obs:
     """(N, 3) point cloud in robot frame"""
 
 
+@dataclass
+class GraspTask:
+    obj_pose: np.ndarray
+    """(4, 4) object pose in world frame"""
+    grasps: List[Grasp]
+    """grasp candidates in robot frame"""
+    pc: np.ndarray
+    """(N, 3) point cloud in robot frame"""
+    seed: int = 0
+    """random seed of the episode, the result only depends on the task"""
+
+
+@dataclass
+class GraspResult:
+    index: int
+    """index of the task"""
+    succ: bool
+    """whether the object was lifted"""
+    plan_found: bool
+    """whether any grasp could be planned"""
+    plan_time: float
+    """seconds spent planning"""
+    exec_time: float
+    """seconds spent resetting and executing in simulation"""
+
+
 @dataclass
 class GraspEnvConfig:
     robot: str
@@ -48,6 +78,9 @@ class GraspEnvConfig:
     succ_height_thresh: float = 0.05
     grasp_trans_z_thresh: float = 0.01
     grasp_trans_z_violate: float = 0.025
+    collision_interp: int = 2
+    reachability_path: Optional[str] = None
+    ik_cache_path: Optional[str] = None
     obj_pose: Optional[np.ndarray] = None
 
 
@@ -58,6 +91,16 @@ class GraspEnv:
         self.robot_cfg = get_robot_cfg(config.robot)
         self.robot_model = RobotModel(self.robot_cfg)
         self.obj_name = config.obj_name
+        # built offline by build_reachability.py, used to skip unreachable grasps before IK
+        self.reachability = None
+        if config.reachability_path is not None:
+            self.reachability = ReachabilityMap.load(config.reachability_path)
+        # loaded here if the file exists and saved by close()
+        if config.ik_cache_path is not None:
+            self.robot_model.enable_ik_cache(config.ik_cache_path)
+        # created by the first parallel select_grasps and kept until close()
+        self.plan_pool = None
+        self.plan_pool_size = 0
 
     def launch(self):
         """launch the simulation."""
@@ -72,29 +115,41 @@ class GraspEnv:
             )
         )
         scene = get_default_scene()
-        if config.obj_pose is None:
+        self.obj = get_obj(self.obj_name, self.get_obj_init_pose(config.obj_pose))
+        scene.obj_list.append(self.obj)
+        for o in scene.obj_list:
+            self.sim.add_obj(o)
+        self.sim.launch()
+        # the model is compiled once, episodes restore this snapshot instead
+        self.init_state = self.sim.save_state()
+
+    def get_obj_init_pose(self, obj_pose: Optional[np.ndarray] = None) -> np.ndarray:
+        """The initial object pose, randomly sampled if obj_pose is None."""
+        if obj_pose is None:
             obj_init_trans = np.array([0.45, 0.2, 0.6])
             obj_init_trans[:2] += np.random.uniform(-0.05, 0.05, 2)
             obj_pose = to_pose(obj_init_trans, rand_rot_mat())
         else:
-            obj_pose = config.obj_pose.copy()
+            obj_pose = obj_pose.copy()
             obj_pose[2, 3] += 0.0025
-        self.obj = get_obj(self.obj_name, obj_pose)
-        scene.obj_list.append(self.obj)
-        for o in scene.obj_list:
-            self.sim.add_obj(o)
-        self.sim.launch()
+        return obj_pose
+
+    def reset(self, obj_pose: Optional[np.ndarray] = None, rand_obj: bool = False):
+        """reset the simulation so that the robot is in the initial position. we step the simulation for a few steps to make sure the environment is stable.
 
-    def reset(self):
-        """reset the simulation so that the robot is in the initial position. we step the simulation for a few steps to make sure the environment is stable."""
+        The full simulation state is restored to the snapshot taken at launch, so one launched environment can be reused across episodes. If obj_pose is given, the object is moved there first, as GraspEnvConfig.obj_pose does at launch. If rand_obj is True, the object is moved to a random pose as when launched without obj_pose."""
+        self.sim.restore_state(self.init_state)
+        if obj_pose is not None or rand_obj:
+            self.obj.pose = self.get_obj_init_pose(obj_pose)
+            self.sim.set_body_pose(self.obj.geom_id, self.obj.pose)
         init_qpos = self.robot_cfg.joint_init_qpos.copy()
         self.sim.reset(init_qpos)
         _qpos = init_qpos[:8]
         for _ in range(self.config.wait_steps):
             self.sim.step(_qpos)
 
-    def get_obs(self) -> Obs:
-        """Get the observation from the simulation"""
+    def get_obs(self, with_rgb: bool = True) -> Obs:
+        """Get the observation from the simulation. Skip rendering the rgb image if with_rgb is False, e.g. when only depth and segmentation are needed."""
         init_qpos = self.robot_cfg.joint_init_qpos.copy()
         cam_trans, cam_rot = self.robot_model.fk_camera(init_qpos)
         cam_pose = to_pose(cam_trans, cam_rot)
@@ -104,15 +159,13 @@ class GraspEnv:
             self.robot_cfg.camera_cfg.intrinsics,
             cam_pose.copy(),
         )
-        x = self.sim.render(render_cfg)
+        modes = ("rgb", "depth", "seg") if with_rgb else ("depth", "seg")
+        x = self.sim.render(render_cfg, modes)
         obj_ids = self.sim.get_seg_id_list(self.obj.name)
-        seg = x["seg"][..., 0]
-        obj_seg = np.zeros_like(seg).astype(np.uint8)
-        for i in range(len(obj_ids)):
-            obj_seg[seg == obj_ids[i]] = 255
+        obj_seg = np.isin(x["seg"][..., 0], obj_ids).astype(np.uint8) * 255
         obj_pose = to_pose(*self.sim.get_body_pose(self.obj.geom_id))
         obs = Obs(
-            rgb=x["rgb"],
+            rgb=x.get("rgb"),
             depth=x["depth"],
             seg=obj_seg,
             camera_pose=cam_pose,
@@ -140,7 +193,8 @@ class GraspEnv:
             timestamp = time.strftime("%Y%m%d_%H%M%S")
             data_dir = os.path.join("data", "pose2", timestamp)
         os.makedirs(data_dir)
-        Image.fromarray(obs.rgb).save(os.path.join(data_dir, "rgb.png"))
+        if obs.rgb is not None:
+            Image.fromarray(obs.rgb).save(os.path.join(data_dir, "rgb.png"))
         Image.fromarray(
             (np.clip(obs.depth, 0, 2.0) * DEPTH_IMG_SCALE).astype(np.uint16)
         ).save(os.path.join(data_dir, "depth.png"))
@@ -148,11 +202,25 @@ class GraspEnv:
         np.save(os.path.join(data_dir, "camera_pose.npy"), obs.camera_pose)
         np.save(os.path.join(data_dir, "object_pose.npy"), obs.object_pose)
 
-    def plan_grasp(self, grasp: Grasp, pc: np.ndarray) -> Optional[np.ndarray]:
-        """Try to plan a grasp trajectory for the given grasp. The trajectory is a list of joint positions. Return None if the trajectory is not valid."""
-        start_gripper_angle = 0.0
+    def get_scene(self, pc: np.ndarray) -> SceneGrid:
+        """Build the collision scene from the robot frame point cloud, once per observation."""
+        return SceneGrid.from_points(pc[get_workspace_mask(pc)])
+
+    def get_eef_trans(self, grasp: Grasp) -> np.ndarray:
+        """The end-effector translation of a grasp, moved back along the approach direction by the fingertip depth."""
         _, depth = self.robot_cfg.gripper_width_to_angle_depth(grasp.width)
-        grasp_trans = grasp.trans - depth * grasp.rot[:, 0]
+        return grasp.trans - depth * grasp.rot[:, 0]
+
+    def plan_grasp(
+        self, grasp: Grasp, pc: Union[np.ndarray, SceneGrid]
+    ) -> Optional[np.ndarray]:
+        """Try to plan a grasp trajectory for the given grasp. The trajectory is a list of joint positions. Return None if the trajectory is not valid. pc can be the point cloud or the scene from get_scene."""
+        start_gripper_angle = 0.0
+        grasp_trans = self.get_eef_trans(grasp)
+        if self.reachability is not None and not self.reachability.is_reachable(
+            grasp_trans, grasp.rot
+        ):
+            return None
         succ, grasp_arm_qpos = self.robot_model.ik(grasp_trans, grasp.rot)
         if not succ:
             return None
@@ -163,23 +231,30 @@ class GraspEnv:
             )
 
         traj = [add_gripper_qpos(grasp_arm_qpos, start_gripper_angle)]
-        pc_mask = get_workspace_mask(pc)
-        if self.robot_model.check_collision(traj[0], pc[pc_mask])[0]:
+        scene = pc if isinstance(pc, SceneGrid) else self.get_scene(pc)
+        if self.robot_model.check_collision(traj[0], scene)[0]:
             return None
 
-        cur_trans, cur_rot, cur_qpos = (
-            grasp_trans.copy(),
-            grasp.rot.copy(),
-            grasp_arm_qpos.copy(),
+        # back off along the approach direction, warm-started from the grasp
+        steps = np.arange(1, self.config.reach_steps + 1)[:, None]
+        fail, reach_qpos = self.robot_model.ik_path(
+            grasp_trans - steps * self.config.delta_dist * grasp.rot[:, 0],
+            np.broadcast_to(grasp.rot, (len(steps), 3, 3)),
+            grasp_arm_qpos,
+            delta_thresh=0.5,
         )
-        for _ in range(self.config.reach_steps):
-            cur_trans = cur_trans - self.config.delta_dist * cur_rot[:, 0]
-            succ, cur_qpos = self.robot_model.ik(
-                cur_trans, cur_rot, cur_qpos, delta_thresh=0.5
-            )
-            if not succ:
-                return None
-            traj = [add_gripper_qpos(cur_qpos, start_gripper_angle)] + traj
+        if fail >= 0:
+            return None
+        traj = [
+            add_gripper_qpos(qpos, start_gripper_angle) for qpos in reach_qpos[::-1]
+        ] + traj
+
+        # the approach must be collision free, the squeeze and lift touch the object on purpose
+        idx, _ = self.robot_model.check_trajectory_collision(
+            np.stack(traj), scene, num_interp=self.config.collision_interp
+        )
+        if idx >= 0:
+            return None
 
         target_gripper_angle, _ = self.robot_cfg.gripper_width_to_angle_depth(0.0)
 
@@ -194,40 +269,191 @@ class GraspEnv:
                 )
             )
 
-        cur_trans, cur_rot, cur_qpos = (
-            grasp_trans.copy(),
-            grasp.rot.copy(),
-            grasp_arm_qpos.copy(),
+        steps = np.arange(1, self.config.lift_steps + 1)[:, None]
+        fail, lift_qpos = self.robot_model.ik_path(
+            grasp_trans + steps * self.config.delta_dist * np.array([0, 0, 1]),
+            np.broadcast_to(grasp.rot, (len(steps), 3, 3)),
+            grasp_arm_qpos,
+            delta_thresh=0.5,
         )
-        for _ in range(self.config.lift_steps):
-            cur_trans[2] += self.config.delta_dist
-            succ, cur_qpos = self.robot_model.ik(
-                cur_trans, cur_rot, cur_qpos, delta_thresh=0.5
-            )
-            if not succ:
-                return None
-            traj.append(add_gripper_qpos(cur_qpos, target_gripper_angle))
+        if fail >= 0:
+            return None
+        traj += [add_gripper_qpos(qpos, target_gripper_angle) for qpos in lift_qpos]
 
         return traj
 
+    def select_grasps(
+        self,
+        grasps: List[Grasp],
+        pc: Union[np.ndarray, SceneGrid],
+        try_plan_num: int = 1,
+        num_workers: Optional[int] = 0,
+    ) -> List[Tuple[float, Grasp, List[np.ndarray]]]:
+        """
+        Plan all grasp candidates, optionally in parallel, and rank the feasible plans.
+
+        The planning workers are spawned once and kept until close(), each
+        with its own robot model, so no simulation or OpenGL state is shared
+        with them. Every call sends each worker the scene and its share of
+        the grasps. With an IK cache, the cached solutions of the grasps are
+        sent along and the new ones are merged back.
+
+        Parameters
+        ----------
+        grasps : List[Grasp]
+            Grasp candidates in the robot frame, e.g. including the flipped ones.
+        pc : Union[np.ndarray, SceneGrid]
+            The point cloud or the scene from get_scene.
+        try_plan_num : int
+            Number of planning attempts per grasp.
+        num_workers : Optional[int]
+            Number of worker processes, None for the number of CPUs.
+            0 plans in this process.
+
+        Returns
+        -------
+        List[Tuple[float, Grasp, List[np.ndarray]]]
+            (cost, grasp, plan) of every feasible grasp, cheapest first.
+            The cost is the joint travel of the plan.
+        """
+        scene = pc if isinstance(pc, SceneGrid) else self.get_scene(pc)
+        seeds = np.random.randint(2**31, size=len(grasps))
+        if num_workers == 0:
+            plans = [
+                plan_with_retries(self, g, scene, s, try_plan_num)
+                for g, s in zip(grasps, seeds)
+            ]
+        else:
+            num_workers = num_workers or os.cpu_count()
+            if self.plan_pool is None or self.plan_pool_size != num_workers:
+                if self.plan_pool is not None:
+                    self.plan_pool.terminate()
+                self.plan_pool = mp.get_context("spawn").Pool(
+                    num_workers, initializer=_init_planner, initargs=(self.config,)
+                )
+                self.plan_pool_size = num_workers
+            cache = self.robot_model.ik_cache
+            tasks = []
+            for w in range(num_workers):
+                chunk = list(range(w, len(grasps), num_workers))
+                worker_cache = None
+                if cache is not None:
+                    worker_cache = cache.subset(
+                        cache.key(self.get_eef_trans(grasps[i]), grasps[i].rot)
+                        for i in chunk
+                    )
+                tasks.append(
+                    (
+                        [grasps[i] for i in chunk],
+                        seeds[chunk],
+                        try_plan_num,
+                        scene,
+                        worker_cache,
+                    )
+                )
+            plans = [None] * len(grasps)
+            for w, (chunk_plans, worker_cache) in enumerate(
+                self.plan_pool.map(_plan_chunk, tasks)
+            ):
+                plans[w::num_workers] = chunk_plans
+                if worker_cache is not None:
+                    cache.merge(worker_cache)
+
+        ranked = [
+            (plan_cost(plan), grasp, plan)
+            for grasp, plan in zip(grasps, plans)
+            if plan is not None
+        ]
+        return sorted(ranked, key=lambda x: x[0])
+
     def execute_plan(self, traj: np.ndarray) -> bool:
         """Execute the planned trajectory in the simulation and check if the grasp was successful."""
         obj_init_z = self.sim.get_body_pose(self.obj.geom_id)[0][2]
         self.sim.reset(traj[0])
-        for _ in range(3):
-            self.sim.step(traj[0][:8])
-        for qpos in traj:
-            self.sim.step(qpos[:8])
+        actions = np.stack([traj[0][:8]] * 3 + [qpos[:8] for qpos in traj])
+        obj_pos, _ = self.sim.run_trajectory(actions, [self.obj.geom_id])
 
-        obj_final_z = self.sim.get_body_pose(self.obj.geom_id)[0][2]
+        obj_final_z = obj_pos[-1, 0, 2]
         if obj_final_z - obj_init_z > self.config.succ_height_thresh:
             return True
         else:
             return False
 
+    def run_task(
+        self,
+        task: GraspTask,
+        index: int = 0,
+        try_plan_num: int = 1,
+        plan_workers: Optional[int] = 0,
+    ) -> GraspResult:
+        """Run one grasp episode: reset to the task's object pose, plan all grasps and execute the cheapest plan."""
+        np.random.seed(task.seed)
+        start = time.time()
+        self.reset(task.obj_pose)
+        reset_time = time.time() - start
+
+        start = time.time()
+        plans = self.select_grasps(
+            task.grasps, task.pc, try_plan_num=try_plan_num, num_workers=plan_workers
+        )
+        plan_time = time.time() - start
+
+        start = time.time()
+        succ = self.execute_plan(plans[0][2]) if len(plans) else False
+        return GraspResult(
+            index=index,
+            succ=succ,
+            plan_found=len(plans) > 0,
+            plan_time=plan_time,
+            exec_time=reset_time + time.time() - start,
+        )
+
     def close(self):
-        """close the simulation."""
+        """close the simulation and the planning workers, and save the IK cache."""
         self.sim.close()
+        if self.plan_pool is not None:
+            self.plan_pool.terminate()
+            self.plan_pool.join()
+            self.plan_pool = None
+        if self.robot_model.ik_cache is not None:
+            self.robot_model.ik_cache.save()
+
+
+def plan_cost(traj: List[np.ndarray]) -> float:
+    """Joint travel of a trajectory, the sum of joint position changes between waypoints."""
+    return float(np.linalg.norm(np.diff(np.stack(traj), axis=0), axis=-1).sum())
+
+
+def plan_with_retries(
+    env: GraspEnv, grasp: Grasp, scene: SceneGrid, seed: int, try_plan_num: int
+) -> Optional[List[np.ndarray]]:
+    """Plan a grasp up to try_plan_num times. The random state is reseeded so the result doesn't depend on where it is planned."""
+    np.random.seed(seed)
+    for _ in range(try_plan_num):
+        plan = env.plan_grasp(grasp, scene)
+        if plan is not None:
+            return plan
+    return None
+
+
+# the planner of each planning worker process, its simulation is never launched
+_planner: Optional[GraspEnv] = None
+
+
+def _init_planner(config: GraspEnvConfig):
+    global _planner
+    # the IK cache is owned by the main process, which sends the relevant entries
+    _planner = GraspEnv(replace(config, ik_cache_path=None))
+
+
+def _plan_chunk(task) -> Tuple[List[Optional[List[np.ndarray]]], Optional[IKCache]]:
+    grasps, seeds, try_plan_num, scene, cache = task
+    _planner.robot_model.ik_cache = cache
+    plans = [
+        plan_with_retries(_planner, g, scene, s, try_plan_num)
+        for g, s in zip(grasps, seeds)
+    ]
+    return plans, cache
 
 
 def get_default_scene() -> Scene:
@@ -2,7 +2,7 @@ import os
 from contextlib import contextmanager
 from pathlib import Path
 import time
-from typing import Union
+from typing import Dict, List, Optional, Sequence, Tuple, Union
 import numpy as np
 from transforms3d.quaternions import quat2mat, mat2quat
 
@@ -20,6 +20,16 @@ from .constants import (
     DEBUG_AXIS_BODY_NAME,
 )
 
+# keyword arguments of MovableCamera.render for each image mode
+RENDER_MODES = dict(
+    rgb=dict(),
+    depth=dict(depth=True),
+    seg=dict(segmentation=True),
+)
+
+# everything mj_step depends on, so that a restored snapshot replays identically
+FULL_STATE = mujoco.mjtState.mjSTATE_INTEGRATION
+
 
 @contextmanager
 def temp_work_dir(target_path):
@@ -51,6 +61,7 @@ class MjSim:
         self.headless = sim_cfg.headless
         self.ctrl_dt = sim_cfg.ctrl_dt
         self.sim_dt = sim_cfg.sim_dt
+        self.num_substeps = int(self.ctrl_dt / self.sim_dt)
         self.viewer_cfg = sim_cfg.viewer_cfg
         self.render_cfg = sim_cfg.renderer_cfg
         self.use_debug_robot = sim_cfg.use_debug_robot
@@ -70,6 +81,7 @@ class MjSim:
         self.debug_robot_joint_ids = []
         self.debug_actuator_ids = []
         self.geom_dict = {}
+        self._renderers = {}
 
     def launch(self):
         # launch simulator
@@ -131,18 +143,100 @@ class MjSim:
         if not self.headless:
             self.viewer.sync()
 
+    def save_state(self) -> np.ndarray:
+        """Snapshot the full simulation state, including ctrl and the warm-start accelerations."""
+        assert self.launched, "Simulator not launched"
+        state = np.empty(mujoco.mj_stateSize(self.mj_model, FULL_STATE))
+        mujoco.mj_getState(self.mj_model, self.mj_data, state, FULL_STATE)
+        return state
+
+    def restore_state(self, state: np.ndarray):
+        """Restore a snapshot from save_state in place, without recompiling the model."""
+        assert self.launched, "Simulator not launched"
+        mujoco.mj_setState(self.mj_model, self.mj_data, state, FULL_STATE)
+        mujoco.mj_forward(self.mj_model, self.mj_data)
+        if not self.headless:
+            self.viewer.sync()
+
+    def set_body_pose(self, body_name: str, pose: np.ndarray):
+        """Move a body to a pose (4, 4), through its free joint if it has one."""
+        assert self.launched, "Simulator not launched"
+        body_id = self.get_body_id(body_name)
+        assert body_id >= 0, f"Body {body_name} not found"
+        joint_id = self.mj_model.body_jntadr[body_id]
+        if joint_id >= 0:
+            qpos_adr = self.mj_model.jnt_qposadr[joint_id]
+            dof_adr = self.mj_model.jnt_dofadr[joint_id]
+            self.mj_data.qpos[qpos_adr : qpos_adr + 3] = pose[:3, 3]
+            self.mj_data.qpos[qpos_adr + 3 : qpos_adr + 7] = mat2quat(pose[:3, :3])
+            self.mj_data.qvel[dof_adr : dof_adr + 6] = 0.0
+        else:
+            self.mj_model.body_pos[body_id] = pose[:3, 3]
+            self.mj_model.body_quat[body_id] = mat2quat(pose[:3, :3])
+        mujoco.mj_forward(self.mj_model, self.mj_data)
+        if not self.headless:
+            self.viewer.sync()
+
     def step(self, action):
         assert self.launched, "Simulator not launched"
 
+        start = time.time()
         self.mj_data.ctrl[self.robot_actuator_ids] = action
-        for _ in range(int(self.ctrl_dt / self.sim_dt)):
-            mujoco.mj_step(self.mj_model, self.mj_data)
-            if self.cfg.realtime_sync:
-                time.sleep(self.sim_dt)
+        # all substeps of a control step in one native call
+        mujoco.mj_step(self.mj_model, self.mj_data, nstep=self.num_substeps)
+        if self.cfg.realtime_sync:
+            time.sleep(max(0.0, self.ctrl_dt - (time.time() - start)))
 
         if not self.headless:
             self.viewer.sync()
 
+    def run_trajectory(
+        self, actions: np.ndarray, body_names: Optional[List[str]] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Apply a sequence of robot controls, one control step each.
+
+        Without a viewer or realtime sync, the controls are written and the
+        substeps of each control step run in one mj_step call directly in
+        this loop, skipping the bookkeeping of step(). The physics itself
+        dominates the cost, so this only saves the Python overhead per
+        control step, which matters for long open-loop trajectories.
+
+        Parameters
+        ----------
+        actions : np.ndarray
+            (T, nu) controls of the robot actuators.
+        body_names : Optional[List[str]]
+            Bodies whose poses are recorded after every control step.
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            (T, B, 3) positions and (T, B, 3, 3) rotations of the bodies.
+        """
+        assert self.launched, "Simulator not launched"
+        body_ids = np.array(
+            [self.get_body_id(name) for name in (body_names or [])], dtype=int
+        )
+        pos = np.zeros((len(actions), len(body_ids), 3))
+        rot = np.zeros((len(actions), len(body_ids), 9))
+        if self.cfg.realtime_sync or not self.headless:
+            for t, action in enumerate(actions):
+                self.step(action)
+                pos[t] = self.mj_data.xpos[body_ids]
+                rot[t] = self.mj_data.xmat[body_ids]
+            return pos, rot.reshape(-1, len(body_ids), 3, 3)
+
+        model, data = self.mj_model, self.mj_data
+        ctrl, xpos, xmat = data.ctrl, data.xpos, data.xmat
+        actuator_ids, nstep = np.array(self.robot_actuator_ids, dtype=int), self.num_substeps
+        for t, action in enumerate(actions):
+            ctrl[actuator_ids] = action
+            mujoco.mj_step(model, data, nstep=nstep)
+            pos[t] = xpos[body_ids]
+            rot[t] = xmat[body_ids]
+        return pos, rot.reshape(-1, len(body_ids), 3, 3)
+
     def add_obj(self, obj: Obj):
         assert not self.launched, "Cannot add object after simulator is launched"
         assert isinstance(obj, Obj), f"{obj} must be instance of {Obj}"
@@ -162,19 +256,35 @@ class MjSim:
         else:
             raise ValueError(f"Unsupported object type: {type(obj)}")
 
-    def render(self, render_cfg=None):
-        mode_kwargs = dict(
-            rgb=dict(),
-            depth=dict(depth=True),
-            seg=dict(segmentation=True),
-        )
-
+    def render(
+        self,
+        render_cfg=None,
+        modes: Sequence[str] = tuple(RENDER_MODES),
+        out: Optional[Dict[str, np.ndarray]] = None,
+    ) -> Dict[str, np.ndarray]:
+        """
+        Render images from the camera of render_cfg, or the default renderer.
+
+        Parameters
+        ----------
+        render_cfg : Optional[MjRenderConfig]
+            The camera to render from. Renderers are cached by
+            (height, width, fovy), only the camera pose is set per call.
+        modes : Sequence[str]
+            Which of "rgb", "depth" and "seg" to render, one pass each.
+        out : Optional[Dict[str, np.ndarray]]
+            Preallocated images to write into, e.g. the result of a previous
+            call. New arrays are allocated for the missing modes.
+
+        Returns
+        -------
+        Dict[str, np.ndarray]
+            The images of the requested modes.
+        """
         if render_cfg is not None:
-            renderer = MovableCamera(
-                self.physics, height=render_cfg.height, width=render_cfg.width
+            renderer = self.get_renderer(
+                render_cfg.height, render_cfg.width, render_cfg.fovy
             )
-            if render_cfg.fovy is not None:
-                renderer._physics.model.vis.global_.fovy = render_cfg.fovy
             renderer.set_pose(
                 render_cfg.lookat,
                 render_cfg.distance,
@@ -183,11 +293,32 @@ class MjSim:
             )
         else:
             renderer = self.renderer
-        return {k: renderer.render(**v).copy() for k, v in mode_kwargs.items()}
+
+        ret = dict() if out is None else out
+        for mode in modes:
+            # the renderer returns views of its internal buffers
+            image = renderer.render(**RENDER_MODES[mode])
+            if ret.get(mode) is None or ret[mode].shape != image.shape:
+                ret[mode] = np.empty_like(image)
+            np.copyto(ret[mode], image)
+        return ret
+
+    def get_renderer(
+        self, height: int, width: int, fovy: Optional[float] = None
+    ) -> MovableCamera:
+        """Get the cached renderer of this image size and field of view."""
+        key = (height, width, fovy)
+        if key not in self._renderers:
+            self._renderers[key] = MovableCamera(self.physics, height=height, width=width)
+        if fovy is not None:
+            # fovy is a global of the model, shared by all renderers
+            self.physics.model.vis.global_.fovy = fovy
+        return self._renderers[key]
 
     def close(self):
         if not self.headless:
             self.viewer.close()
+        self._renderers = {}
         self.physics.free()
         self.launched = False
 
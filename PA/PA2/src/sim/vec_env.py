@@ -0,0 +1,98 @@
+import queue
+import multiprocessing as mp
+from dataclasses import replace
+from typing import Iterable, Iterator, Optional
+
+from src.sim.grasp_env import GraspEnv, GraspEnvConfig, GraspTask, GraspResult
+
+
+# the environment of each worker process, compiled once
+_env: Optional[GraspEnv] = None
+
+
+def init_worker(config: GraspEnvConfig):
+    """Pool initializer launching the environment of a worker process, get it with worker_env()."""
+    global _env
+    _env = GraspEnv(config)
+    _env.launch()
+
+
+def worker_env() -> GraspEnv:
+    """The environment launched by init_worker in this process."""
+    return _env
+
+
+def _run_task(args) -> GraspResult:
+    index, task, try_plan_num = args
+    return _env.run_task(task, index, try_plan_num)
+
+
+class VecGraspEnv:
+    def __init__(self, config: GraspEnvConfig, num_envs: int):
+        """
+        A pool of worker processes, each keeping one launched headless GraspEnv.
+
+        Every task starts from the snapshot of a freshly launched environment
+        and reseeds the random state, so the results don't depend on which
+        worker runs it and match GraspEnv.run_task in a single process.
+
+        Parameters
+        ----------
+        config : GraspEnvConfig
+            Configuration of the environments, headless is forced.
+        num_envs : int
+            Number of worker processes.
+        """
+        self.config = replace(config, headless=True)
+        self.num_envs = num_envs
+        # spawn instead of fork so that no OpenGL or viewer state is inherited
+        self.pool = mp.get_context("spawn").Pool(
+            num_envs, initializer=init_worker, initargs=(self.config,)
+        )
+
+    def run(
+        self, tasks: Iterable[GraspTask], try_plan_num: int = 1
+    ) -> Iterator[GraspResult]:
+        """
+        Run grasp tasks on the workers.
+
+        The tasks are read on the calling thread, at most two per worker
+        ahead of the results, so a task generator doing model inference or
+        visualization runs in the main thread and its errors propagate
+        here, as do the errors of the workers. Results are yielded as soon
+        as they finish, use GraspResult.index to match them with the tasks.
+        """
+        tasks = enumerate(tasks)
+        done = queue.Queue()
+        num_running = 0
+        while True:
+            while num_running < 2 * self.num_envs:
+                item = next(tasks, None)
+                if item is None:
+                    break
+                index, task = item
+                self.pool.apply_async(
+                    _run_task,
+                    ((index, task, try_plan_num),),
+                    callback=done.put,
+                    error_callback=done.put,
+                )
+                num_running += 1
+            if num_running == 0:
+                return
+            result = done.get()
+            num_running -= 1
+            if isinstance(result, BaseException):
+                raise result
+            yield result
+
+    def close(self):
+        """Stop the workers."""
+        self.pool.terminate()
+        self.pool.join()
+
+    def __enter__(self) -> "VecGraspEnv":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,23 @@
+import json
+import pytest
+
+from src.sim.grasp_env import GraspEnvConfig
+from src.sim.datagen import DataGenerator
+
+
+def test_resume_checks_meta(tmp_path):
+    config = GraspEnvConfig(robot="galbot", obj_name="power_drill", headless=True, ctrl_dt=0.1)
+    data_root = str(tmp_path / "train")
+    DataGenerator(config, data_root, 10, shard_size=4)
+    with open(tmp_path / "train" / "meta.json") as f:
+        meta = json.load(f)
+    assert meta["ctrl_dt"] == 0.1 and meta["wait_steps"] == config.wait_steps
+
+    # the same settings resume, the GraspEnvConfig fields that don't change samples are free
+    DataGenerator(config, data_root, 10, shard_size=4)
+    config.collision_interp += 1
+    DataGenerator(config, data_root, 10, shard_size=4)
+    with pytest.raises(ValueError):
+        DataGenerator(GraspEnvConfig("galbot", "power_drill", True, ctrl_dt=0.05), data_root, 10, shard_size=4)
+    with pytest.raises(ValueError):
+        DataGenerator(config, data_root, 10, shard_size=5)
@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+from transforms3d.euler import euler2mat
+
+from src.robot.ik_cache import IKCache
+
+
+def test_key_quantization():
+    cache = IKCache(trans_res=0.01, rot_res=0.05)
+    rot = euler2mat(0.3, -0.2, 1.0)
+    key = cache.key(np.array([0.1, 0.2, 0.3]), rot)
+    assert len(key) == 7
+    # poses in the same cell share the key, others don't
+    assert cache.key(np.array([0.1024, 0.1976, 0.3]), euler2mat(0.301, -0.2, 1.0)) == key
+    assert cache.key(np.array([0.11, 0.2, 0.3]), rot) != key
+    assert cache.key(np.array([0.1, 0.2, 0.3]), euler2mat(0.5, -0.2, 1.0)) != key
+    # q and -q are the same rotation, a rotation of pi about x has w = 0 either way
+    flip = euler2mat(np.pi, 0, 0)
+    assert cache.key(np.zeros(3), flip) == cache.key(np.zeros(3), euler2mat(-np.pi, 0, 0))
+
+
+def test_get_put_and_lru_eviction():
+    cache = IKCache(trans_res=0.01, capacity=3)
+    rot = np.eye(3)
+    assert cache.get(np.zeros(3), rot) is None
+    for i in range(3):
+        cache.put(np.array([i, 0, 0]), rot, np.full(7, i))
+    # reading entry 0 makes entry 1 the least recently used one
+    assert np.array_equal(cache.get(np.zeros(3), rot), np.zeros(7))
+    cache.put(np.array([3, 0, 0]), rot, np.full(7, 3))
+    assert len(cache.entries) == 3
+    assert cache.get(np.array([1, 0, 0]), rot) is None
+    assert cache.get(np.array([2, 0, 0]), rot) is not None
+    # the returned solution is a copy
+    cache.get(np.array([3, 0, 0]), rot)[:] = -1
+    assert np.array_equal(cache.get(np.array([3, 0, 0]), rot), np.full(7, 3))
+    stats = cache.stats()
+    assert stats["hits"] == 4 and stats["misses"] == 2 and stats["entries"] == 3
+
+
+def test_save_load(tmp_path):
+    path = str(tmp_path / "cache" / "ik.npz")
+    cache = IKCache(path, trans_res=0.01)
+    rot = euler2mat(0.1, 0.2, 0.3)
+    for i in range(5):
+        cache.put(np.array([0.1 * i, 0, 0]), rot, np.full(7, float(i)))
+    cache.get(np.zeros(3), rot)
+    cache.save()
+
+    loaded = IKCache(path, trans_res=0.01)
+    assert list(loaded.entries.keys()) == list(cache.entries.keys())
+    assert all(np.array_equal(loaded.entries[k], v) for k, v in cache.entries.items())
+    # the least recently used entries are evicted when loading into a smaller cache
+    small = IKCache(path, trans_res=0.01, capacity=2)
+    assert list(small.entries.keys()) == list(cache.entries.keys())[-2:]
+    # a file written with another resolution is ignored
+    assert len(IKCache(path, trans_res=0.02).entries) == 0
+
+
+def test_save_without_path():
+    cache = IKCache()
+    with pytest.raises(ValueError):
+        cache.save()
+    with pytest.raises(ValueError):
+        cache.load()
+
+
+def test_subset_merge():
+    cache = IKCache(trans_res=0.01, capacity=4)
+    rot = np.eye(3)
+    targets = [np.array([0.1 * i, 0, 0]) for i in range(4)]
+    for i, t in enumerate(targets[:3]):
+        cache.put(t, rot, np.full(7, float(i)))
+    keys = [cache.key(t, rot) for t in targets[1:]]
+    worker = cache.subset(keys)
+    # only the requested entries that exist, with the same grid
+    assert list(worker.entries.keys()) == keys[:2]
+    assert (worker.trans_res, worker.rot_res, worker.capacity) == (0.01, cache.rot_res, 4)
+    assert worker.hits == worker.misses == 0
+
+    # the worker hits one entry, misses one and solves it
+    assert worker.get(targets[1], rot) is not None
+    assert worker.get(targets[3], rot) is None
+    worker.record_solve(False, 0.5)
+    worker.put(targets[3], rot, np.full(7, 3.0))
+    cache.merge(worker)
+    assert np.array_equal(cache.get(targets[3], rot), np.full(7, 3.0))
+    assert len(cache.entries) == 4
+    stats = cache.stats()
+    assert stats["hits"] == 2 and stats["misses"] == 1 and stats["mean_miss_time"] == 0.5
+
+    # merged entries become the most recently used ones
+    extra = IKCache(trans_res=0.01)
+    extra.put(np.array([1.0, 0, 0]), rot, np.zeros(7))
+    cache.merge(extra)
+    assert len(cache.entries) == 4 and cache.key(targets[0], rot) not in cache.entries
@@ -0,0 +1,46 @@
+import numpy as np
+
+from src.robot.reachability import ReachabilityMap
+from test_robot_model import robot_model, rand_qpos  # noqa: F401, the stand-in arm
+
+
+def eef_poses(robot_model, qpos):
+    return robot_model.fk_all_link_pose(qpos)[:, robot_model.link_index[robot_model.cfg.link_eef]]
+
+
+def test_sampled_poses_are_reachable(robot_model):
+    np.random.seed(0)
+    reach_map = ReachabilityMap()
+    reach_map.build(robot_model, num_samples=200000, batch_size=20000)
+    assert 0 < reach_map.reachable.mean() < 1
+
+    # poses of new joint positions within the limits, dilation covers most of the sampling gaps
+    np.random.seed(1)
+    pose = eef_poses(robot_model, rand_qpos(robot_model, 5000))
+    assert reach_map.is_reachable(pose[:, :3, 3], pose[:, :3, :3]).mean() > 0.99
+    # far out of the arm's reach, and outside of the box which is assumed reachable
+    rot = np.tile(np.eye(3), (2, 1, 1))
+    far = np.stack([reach_map.lower + 0.01, reach_map.upper + 1.0])
+    assert reach_map.is_reachable(far, rot).tolist() == [False, True]
+
+
+def test_dilate_wraps_azimuth():
+    reach_map = ReachabilityMap(num_azimuth=8, num_elevation=4)
+    voxel = tuple(np.array(reach_map.grid_shape) // 2)
+    reach_map.reachable[voxel + (2 * 8 + 0,)] = True
+    reach_map.dilate()
+    cells = reach_map.reachable[voxel].reshape(4, 8)
+    assert cells[1:4][:, [7, 0, 1]].all() and cells.sum() == 9
+    assert reach_map.reachable.sum() == 27 * 9
+
+
+def test_save_load(tmp_path):
+    reach_map = ReachabilityMap(voxel_size=0.05, num_azimuth=6, num_elevation=3)
+    np.random.seed(0)
+    reach_map.reachable = np.random.rand(*reach_map.reachable.shape) < 0.3
+    path = str(tmp_path / "reach" / "map.npz")
+    reach_map.save(path)
+    loaded = ReachabilityMap.load(path)
+    assert np.array_equal(loaded.reachable, reach_map.reachable)
+    assert np.allclose(loaded.lower, reach_map.lower) and np.allclose(loaded.upper, reach_map.upper)
+    assert (loaded.voxel_size, loaded.num_azimuth, loaded.num_elevation) == (0.05, 6, 3)
@@ -0,0 +1,291 @@
+import numpy as np
+import pytest
+
+from src.robot.cfg import RobotCfg
+from src.robot.robot_model import RobotModel
+from src.robot.scene import SceneGrid
+from src.constants import PC_MIN, PC_MAX
+from src.utils import get_workspace_mask
+
+
+# a stand-in for the galbot left arm, the real assets are not part of the repo
+ARM_JOINTS = [
+    # name, parent, child, xyz, rpy, axis, lower, upper
+    ("left_arm_joint1", "left_arm_base_link", "left_arm_link1", "0 0 0", "0 0 0", "0 0 1", -3.05, 3.05),
+    ("left_arm_joint2", "left_arm_link1", "left_arm_link2", "0 0 0", "1.5708 0 3.1416", "0 0 1", -1.7, 1.5708),
+    ("left_arm_joint3", "left_arm_link2", "left_arm_link3", "0 0.35 0", "-1.5708 -1.5708 0", "0 0 1", -2.9, 2.9),
+    ("left_arm_joint4", "left_arm_link3", "left_arm_link4", "0 0 0", "1.5708 0 -3.1416", "0 0 1", -2.1, 2.1),
+    ("left_arm_joint5", "left_arm_link4", "left_arm_link5", "0 0.36 0", "1.5708 0 -3.1416", "0 0 1", -2.9, 2.9),
+    ("left_arm_joint6", "left_arm_link5", "left_arm_link6", "0 0 0", "1.5708 1.5708 0", "0 0 1", -0.7854, 0.7854),
+    ("left_arm_joint7", "left_arm_link6", "left_arm_link7", "0 0 0", "1.5708 0 0", "0 0 1", -1.4, 1.4),
+]
+FIXED_JOINTS = [
+    ("left_arm_joint", "base_link", "left_arm_base_link", "0.008 0.206 1.116", "1.5708 0.05 3.1416"),
+    ("left_gripper_joint", "left_arm_link7", "left_gripper_base_link", "-0.083 0 0", "0 1.5708 0"),
+    ("left_gripper_tcp_joint", "left_gripper_base_link", "left_gripper_tcp_link", "0 0 0.23", "0 0 0"),
+]
+FINGER_JOINTS = [
+    ("finger_l_joint", "revolute", "finger_l", "0 0.03 0.05", "1 0 0", 0.0, 0.8),
+    ("finger_r_joint", "prismatic", "finger_r", "0 -0.03 0.05", "0 1 0", -0.04, 0.0),
+]
+COLLISION_SPHERES = """
+collision_spheres:
+  left_arm_link2:
+    - {center: [0.0, 0.0, 0.0], radius: 0.05}
+    - {center: [0.0, 0.1, 0.0], radius: 0.12}
+  left_arm_link4:
+    - {center: [0.0, 0.0, 0.0], radius: 0.05}
+    - {center: [0.0, 0.15, 0.0], radius: 0.12}
+  left_arm_link6:
+    - {center: [0.0, 0.0, 0.0], radius: 0.04}
+  left_gripper_base_link:
+    - {center: [0.0, 0.0, 0.03], radius: 0.03}
+    - {center: [0.0, 0.0, 0.1], radius: 0.03}
+  finger_l:
+    - {center: [0.0, 0.0, 0.02], radius: 0.01}
+  finger_r:
+    - {center: [0.0, 0.0, 0.02], radius: 0.01}
+"""
+
+
+def write_urdf(path):
+    links = ["base_link", "left_arm_base_link", "left_gripper_base_link", "left_gripper_tcp_link"]
+    links += [j[2] for j in ARM_JOINTS] + [j[2] for j in FINGER_JOINTS]
+    joints = []
+    for name, parent, child, xyz, rpy in FIXED_JOINTS:
+        joints.append(
+            f'<joint name="{name}" type="fixed"><parent link="{parent}"/><child link="{child}"/>'
+            f'<origin xyz="{xyz}" rpy="{rpy}"/></joint>'
+        )
+    for name, parent, child, xyz, rpy, axis, lower, upper in ARM_JOINTS:
+        joints.append(
+            f'<joint name="{name}" type="revolute"><parent link="{parent}"/><child link="{child}"/>'
+            f'<origin xyz="{xyz}" rpy="{rpy}"/><axis xyz="{axis}"/>'
+            f'<limit effort="10" velocity="1" lower="{lower}" upper="{upper}"/></joint>'
+        )
+    for name, joint_type, child, xyz, axis, lower, upper in FINGER_JOINTS:
+        joints.append(
+            f'<joint name="{name}" type="{joint_type}"><parent link="left_gripper_base_link"/>'
+            f'<child link="{child}"/><origin xyz="{xyz}" rpy="0 0 0"/><axis xyz="{axis}"/>'
+            f'<limit effort="1" velocity="1" lower="{lower}" upper="{upper}"/></joint>'
+        )
+    with open(path, "w") as f:
+        f.write('<?xml version="1.0"?><robot name="arm">')
+        f.write("".join(f'<link name="{l}"/>' for l in links))
+        f.write("".join(joints))
+        f.write("</robot>")
+
+
+@pytest.fixture(scope="module")
+def robot_model(tmp_path_factory):
+    root = tmp_path_factory.mktemp("robot")
+    write_urdf(root / "arm.urdf")
+    (root / "spheres.yml").write_text(COLLISION_SPHERES)
+    cfg = RobotCfg(
+        path_urdf=str(root / "arm.urdf"),
+        path_collision=str(root / "spheres.yml"),
+        link_eef="left_gripper_tcp_link",
+        joint_names=[j[0] for j in ARM_JOINTS] + [j[0] for j in FINGER_JOINTS],
+        collision_ignore={
+            "left_arm_link6": ["left_gripper_base_link", "finger_l", "finger_r"],
+            "left_gripper_base_link": ["finger_l", "finger_r"],
+            "finger_l": ["finger_r"],
+        },
+    )
+    return RobotModel(cfg)
+
+
+def rand_qpos(robot_model, num, margin=0.0):
+    """Uniform joint positions in cfg.joint_names order, away from the limits by margin of the range."""
+    lower, upper = robot_model.kinematics.joint_lower, robot_model.kinematics.joint_upper
+    ratio = np.random.uniform(margin, 1 - margin, (num, len(lower)))
+    return lower + ratio * (upper - lower)
+
+
+def to_rtb_qpos(robot_model, qpos):
+    """Reorder qpos from cfg.joint_names to the joint order of roboticstoolbox."""
+    child_joint = {j[2]: j[0] for j in ARM_JOINTS + [(j[0], None, j[2]) for j in FINGER_JOINTS]}
+    joint_index = {name: i for i, name in enumerate(robot_model.cfg.joint_names)}
+    ret = np.zeros(robot_model.robot.n)
+    for link in robot_model.robot.links:
+        if link.isjoint:
+            ret[link.jindex] = qpos[joint_index[child_joint[link.name]]]
+    return ret
+
+
+def reference_check_collision(robot_model, qpos, pc, thresh=0.0025):
+    """The sphere by sphere collision check that RobotModel.check_collision replaced."""
+    fk_links = robot_model.fk_all_link(qpos)
+    link_spheres = dict()
+    for link, spheres in robot_model.collision_spheres.items():
+        trans, rot = fk_links[link]
+        center = np.einsum("ab,nb->na", rot, spheres["center"]) + trans
+        link_spheres[link] = dict(center=center, radius=spheres["radius"])
+    for link, spheres in link_spheres.items():
+        for center, radius in zip(spheres["center"], spheres["radius"]):
+            dist = np.linalg.norm(pc[:, None] - center[None], axis=-1) - radius
+            if np.any(dist < thresh):
+                return True, link
+    link_list = list(link_spheres.keys())
+    for i in range(len(link_list)):
+        for j in range(i + 1, len(link_list)):
+            link_a, link_b = link_list[i], link_list[j]
+            if robot_model.cfg.is_collision_ignore(link_a, link_b):
+                continue
+            for center_a, radius_a in zip(link_spheres[link_a]["center"], link_spheres[link_a]["radius"]):
+                for center_b, radius_b in zip(link_spheres[link_b]["center"], link_spheres[link_b]["radius"]):
+                    dist = np.linalg.norm(center_a - center_b) - (radius_a + radius_b)
+                    if dist < thresh:
+                        return True, f"{link_a} and {link_b}"
+    return False, ""
+
+
+def test_fk_matches_fkine(robot_model):
+    np.random.seed(0)
+    qpos = rand_qpos(robot_model, 20)
+    poses = robot_model.fk_all_link_pose(qpos)
+    for q, pose in zip(qpos, poses):
+        q_rtb = to_rtb_qpos(robot_model, q)
+        for name, i in robot_model.link_index.items():
+            expected = robot_model.robot.fkine(q_rtb, end=name).A
+            assert np.allclose(pose[i], expected, atol=1e-6), f"Mismatch at link {name}"
+        assert np.allclose(robot_model.fk_all_link_pose(q), pose)
+
+
+def test_ik_round_trip(robot_model):
+    np.random.seed(0)
+    qpos = rand_qpos(robot_model, 30, margin=0.1)
+    eef = robot_model.link_index[robot_model.cfg.link_eef]
+    poses = robot_model.fk_all_link_pose(qpos)[:, eef]
+    succ, sol = robot_model.ik_batch(poses[:, :3, 3], poses[:, :3, :3])
+    assert succ.mean() >= 0.9
+
+    full = qpos.copy()
+    full[:, robot_model.ik_solver.joint_indices] = sol
+    reached = robot_model.fk_all_link_pose(full)[:, eef]
+    assert np.all(np.linalg.norm(reached[succ, :3, 3] - poses[succ, :3, 3], axis=-1) < 1e-3)
+    assert np.all(np.abs(reached[succ, :3, :3] - poses[succ, :3, :3]) < 1e-2)
+    assert np.all(sol >= robot_model.ik_solver.lower - 1e-9)
+    assert np.all(sol <= robot_model.ik_solver.upper + 1e-9)
+
+    ok, q = robot_model.ik(poses[0, :3, 3], poses[0, :3, :3], init_qpos=sol[0])
+    assert ok and np.allclose(q, sol[0], atol=1e-3)
+
+
+def test_check_collision_matches_reference(robot_model):
+    np.random.seed(0)
+    qpos = rand_qpos(robot_model, 40)
+    # points scattered around the forearm and gripper spheres of other configurations
+    # so that some of them collide, the shoulder spheres are at the same place in all of them
+    centers = robot_model.collision_sphere_centers(rand_qpos(robot_model, 5))
+    shoulder = robot_model.sphere_pose_index == robot_model.link_index["left_arm_link2"]
+    centers = centers[:, ~shoulder].reshape(-1, 3)
+    pc = centers + np.random.normal(0, 0.02, centers.shape)
+    causes = []
+    for q in qpos:
+        expected = reference_check_collision(robot_model, q, pc)
+        assert robot_model.check_collision(q, pc) == expected
+        causes.append(expected[1])
+    # free configurations, collisions with the point cloud and self collisions are all covered
+    assert "" in causes
+    assert any(c and " and " not in c for c in causes)
+    assert any(" and " in c for c in causes)
+
+
+def test_get_pc_tree_cache(robot_model):
+    pc = np.random.uniform(-1, 1, (100, 3))
+    tree = robot_model.get_pc_tree(pc)
+    assert robot_model.get_pc_tree(pc) is tree
+    assert robot_model.get_pc_tree(tree) is tree
+    assert robot_model.get_pc_tree(pc.copy()) is not tree
+
+
+def test_scene_grid_matches_point_cloud(robot_model):
+    np.random.seed(0)
+    qpos = rand_qpos(robot_model, 200)
+    pc = np.random.uniform(PC_MIN, PC_MAX, (5000, 3))
+    pc = pc[get_workspace_mask(pc)]
+    expected = robot_model.collision_report(qpos, pc)
+    actual = robot_model.collision_report(qpos, SceneGrid.from_points(pc))
+    assert np.array_equal(expected[0], actual[0])
+    assert np.array_equal(expected[1], actual[1])
+
+
+def test_scene_grid_repeated_frames():
+    np.random.seed(0)
+    pc = np.random.uniform(PC_MIN, PC_MAX, (2000, 3))
+    # 10 points in the same voxel, only points_per_voxel of them are kept
+    pc = np.concatenate([pc, np.full((10, 3), 0.5 * (PC_MIN + PC_MAX))])
+    grid = SceneGrid.from_points(pc, points_per_voxel=4)
+    assert len(grid.points) == 2004
+    grid.exact_distance(pc[:1])
+    tree = grid._tree
+    grid.integrate(pc)
+    assert len(grid.points) == 2004 and grid._tree is tree
+    assert np.allclose(grid.exact_distance(pc), 0)
+
+
+def test_check_trajectory_collision_matches_reference(robot_model):
+    np.random.seed(1)
+    qpos = rand_qpos(robot_model, 40)
+    centers = robot_model.collision_sphere_centers(rand_qpos(robot_model, 5))
+    shoulder = robot_model.sphere_pose_index == robot_model.link_index["left_arm_link2"]
+    centers = centers[:, ~shoulder].reshape(-1, 3)
+    pc = centers + np.random.normal(0, 0.02, centers.shape)
+    causes = [reference_check_collision(robot_model, q, pc)[1] for q in qpos]
+    assert any(causes)
+    first, cause = robot_model.check_trajectory_collision(qpos, pc)
+    assert first == next(i for i, c in enumerate(causes) if c)
+    assert cause == causes[first]
+
+    free = qpos[[i for i, c in enumerate(causes) if not c]]
+    assert robot_model.check_trajectory_collision(free[:1], pc) == (-1, "")
+    # interpolated configurations between waypoints are reported at the next waypoint
+    first, _ = robot_model.check_trajectory_collision(qpos, pc, num_interp=3)
+    assert 0 <= first <= next(i for i, c in enumerate(causes) if c)
+
+
+def test_joint_limits_and_fk_link_order(robot_model):
+    # the fingers come last in cfg.joint_names, finger_l is limited to [0, 0.8]
+    limits = {j[0]: (j[-2], j[-1]) for j in ARM_JOINTS + FINGER_JOINTS}
+    for name, lower, upper in zip(
+        robot_model.cfg.joint_names, robot_model.joint_lower_limit, robot_model.joint_upper_limit
+    ):
+        assert (lower, upper) == limits[name]
+    np.random.seed(0)
+    for _ in range(5):
+        q = robot_model.uniform_rand_qpos()
+        assert np.all(q >= robot_model.joint_lower_limit) and np.all(q <= robot_model.joint_upper_limit)
+        trans, rot = robot_model.fk_eef(q)
+        expected = robot_model.robot.fkine(to_rtb_qpos(robot_model, q), end=robot_model.cfg.link_eef).A
+        assert np.allclose(trans, expected[:3, 3]) and np.allclose(rot, expected[:3, :3])
+
+
+def test_ik_path(robot_model):
+    # seed 0 starts close to a singularity, where a 5mm step moves the joints a lot
+    np.random.seed(1)
+    qpos = rand_qpos(robot_model, 1, margin=0.2)[0]
+    eef = robot_model.link_index[robot_model.cfg.link_eef]
+    joints = robot_model.ik_solver.joint_indices
+    start = robot_model.fk_all_link_pose(qpos)[eef]
+    # a short approach along the gripper axis, like the ones in plan_grasp
+    trans = start[:3, 3] + np.linspace(0, 0.05, 10)[:, None] * start[:3, 2]
+    rot = np.tile(start[:3, :3], (len(trans), 1, 1))
+    first_fail, path = robot_model.ik_path(trans, rot, qpos[joints], delta_thresh=0.2)
+    assert first_fail == -1
+    full = np.tile(qpos, (len(path), 1))
+    full[:, joints] = path
+    reached = robot_model.fk_all_link_pose(full)[:, eef]
+    assert np.all(np.linalg.norm(reached[:, :3, 3] - trans, axis=-1) < 1e-3)
+    assert np.all(np.abs(reached[:, :3, :3] - rot) < 1e-2)
+    # the joints move by about 0.05 per waypoint
+    first_fail, _ = robot_model.ik_path(trans, rot, qpos[joints], delta_thresh=0.01)
+    assert first_fail == 1
+
+    # the same path continued far out of the workspace, from waypoint 10 on
+    far = trans[-1] + np.linspace(0.5, 3.0, 5)[:, None] * start[:3, 2]
+    trans_far = np.concatenate([trans, far])
+    rot_far = np.tile(start[:3, :3], (len(trans_far), 1, 1))
+    first_fail, path_far = robot_model.ik_path(trans_far, rot_far, qpos[joints])
+    assert first_fail >= len(trans)
+    assert np.allclose(path_far[: len(trans)], path)
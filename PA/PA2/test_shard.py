@@ -0,0 +1,86 @@
+import os
+import pickle
+import numpy as np
+
+from src.shard import DONE_MARKER, ShardReader, is_shard, write_shard
+from src.constants import DEPTH_IMG_SCALE
+
+
+def make_samples(num, seed=0):
+    rng = np.random.default_rng(seed)
+    return [
+        dict(
+            depth=rng.uniform(0, 2, (24, 32)),
+            obj_seg=(rng.uniform(size=(24, 32)) > 0.5).astype(np.uint8) * 255,
+            camera_pose=rng.normal(size=(4, 4)),
+            object_pose=rng.normal(size=(4, 4)),
+        )
+        for _ in range(num)
+    ]
+
+
+def test_write_read_round_trip(tmp_path):
+    path = str(tmp_path / "shard_00000")
+    samples = make_samples(5)
+    write_shard(path, samples)
+    assert is_shard(path)
+    assert not os.path.exists(path + ".tmp")
+
+    reader = ShardReader(path)
+    assert len(reader) == 5
+    # readers are pickled into dataloader workers
+    reader = pickle.loads(pickle.dumps(reader))
+    for i in [3, 0, 4]:
+        sample = reader[i]
+        # depth is stored in PNG as uint16 steps of 1 / DEPTH_IMG_SCALE
+        assert np.allclose(sample["depth"], samples[i]["depth"], atol=1 / DEPTH_IMG_SCALE)
+        assert np.array_equal(sample["obj_seg"], samples[i]["obj_seg"])
+        assert np.array_equal(sample["camera_pose"], samples[i]["camera_pose"])
+        assert np.array_equal(sample["object_pose"], samples[i]["object_pose"])
+
+
+def test_incomplete_shards(tmp_path):
+    path = str(tmp_path / "shard_00000")
+    assert not is_shard(path)
+    # an interrupted write leaves a .tmp directory or a shard without the marker
+    write_shard(path, make_samples(2))
+    os.rename(path, path + ".tmp")
+    assert not is_shard(path) and not is_shard(path + ".tmp")
+    write_shard(path, make_samples(2))
+    os.remove(os.path.join(path, DONE_MARKER))
+    assert not is_shard(path)
+
+
+def test_overwrite(tmp_path):
+    path = str(tmp_path / "shard_00000")
+    write_shard(path, make_samples(2, seed=0))
+    samples = make_samples(3, seed=1)
+    write_shard(path, samples)
+    assert sorted(os.listdir(tmp_path)) == ["shard_00000"]
+    reader = ShardReader(path)
+    assert len(reader) == 3
+    assert np.array_equal(reader[2]["object_pose"], samples[2]["object_pose"])
+
+
+def test_crash_while_replacing_keeps_old_shard(tmp_path, monkeypatch):
+    path = str(tmp_path / "shard_00000")
+    old = make_samples(2, seed=0)
+    write_shard(path, old)
+    replace = os.replace
+
+    def crash(src, dst):
+        if src.endswith(".tmp") and dst == path:
+            raise KeyboardInterrupt
+        replace(src, dst)
+
+    monkeypatch.setattr(os, "replace", crash)
+    try:
+        write_shard(path, make_samples(3, seed=1))
+    except KeyboardInterrupt:
+        pass
+    monkeypatch.undo()
+    # the complete old shard is still on disk next to the new one
+    reader = ShardReader(path + ".old.tmp")
+    assert np.array_equal(reader[1]["object_pose"], old[1]["object_pose"])
+    assert len(ShardReader(path + ".tmp")) == 3
+    assert not is_shard(path + ".old.tmp")